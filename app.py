@@ -7,6 +7,9 @@ from models.user import User
 
 # Services
 from services.i18n_service import i18n
+from services.lexique_index import lexique_index
+from services.product_catalog import product_catalog
+from services.lexique_usage import usage_counter
 
 # Import Blueprints
 from routes.auth import auth_bp
@@ -35,6 +38,9 @@ def create_app(config_class=Config):
 
     # Initialize Services
     i18n.init_app(app)
+    lexique_index.init_app(app)
+    product_catalog.init_app(app)
+    usage_counter.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
@@ -37,6 +37,47 @@ class Config:
     SUPPORTED_LANGUAGES = ['fr', 'en', 'ar', 'dr']
     DEFAULT_LANGUAGE = 'fr'
     
+    # Dictionary usage counters are buffered and written in batches
+    LEXIQUE_USAGE_FLUSH_THRESHOLD = int(os.environ.get('LEXIQUE_USAGE_FLUSH_THRESHOLD', 50))
+    LEXIQUE_USAGE_FLUSH_INTERVAL = int(os.environ.get('LEXIQUE_USAGE_FLUSH_INTERVAL', 30))
+
+    # Maximum number of typos tolerated by the dictionary fuzzy matching
+    LEXIQUE_FUZZY_MAX_DISTANCE = int(os.environ.get('LEXIQUE_FUZZY_MAX_DISTANCE', 2))
+
+    # Translation results cache (entries, seconds; no TTL when unset)
+    LEXIQUE_CACHE_SIZE = int(os.environ.get('LEXIQUE_CACHE_SIZE', 2048))
+    LEXIQUE_CACHE_TTL = int(os.environ['LEXIQUE_CACHE_TTL']) if os.environ.get('LEXIQUE_CACHE_TTL') else None
+
+    # Maximum number of terms accepted by /orders/translate/batch
+    LEXIQUE_BATCH_MAX_TERMS = int(os.environ.get('LEXIQUE_BATCH_MAX_TERMS', 500))
+
+    # Type-ahead completions: maximum results
+    LEXIQUE_AUTOCOMPLETE_MAX_RESULTS = int(os.environ.get('LEXIQUE_AUTOCOMPLETE_MAX_RESULTS', 20))
+
+    # Seconds between two reads of the dictionary usage counts ranking autocomplete and the browser
+    LEXIQUE_USAGE_REFRESH_INTERVAL = float(os.environ.get('LEXIQUE_USAGE_REFRESH_INTERVAL', 60))
+
+    # Entries per page of the dictionary browser
+    LEXIQUE_PAGE_SIZE = int(os.environ.get('LEXIQUE_PAGE_SIZE', 50))
+
+    # Suggestions inserted per INSERT/commit by the dictionary bulk import
+    LEXIQUE_IMPORT_CHUNK_SIZE = int(os.environ.get('LEXIQUE_IMPORT_CHUNK_SIZE', 500))
+
+    # Directory where workers share the binary snapshot of the dictionary index (disabled when unset)
+    LEXIQUE_SNAPSHOT_DIR = os.environ.get('LEXIQUE_SNAPSHOT_DIR')
+
+    # Orders per page of the orders list
+    ORDERS_PAGE_SIZE = int(os.environ.get('ORDERS_PAGE_SIZE', 50))
+
+    # Rows per batch (one INSERT, one UPDATE, one commit) of the product catalog import
+    PRODUCT_IMPORT_CHUNK_SIZE = int(os.environ.get('PRODUCT_IMPORT_CHUNK_SIZE', 500))
+
+    # Companies whose product catalog is kept in memory by each worker
+    PRODUCT_CATALOG_CACHE_SIZE = int(os.environ.get('PRODUCT_CATALOG_CACHE_SIZE', 256))
+
+    # Seconds between two reads of the shared cache versions (changes made by other workers)
+    CACHE_VERSION_CHECK_INTERVAL = float(os.environ.get('CACHE_VERSION_CHECK_INTERVAL', 2))
+
     BC_STATUSES = ['BROUILLON', 'SOUMIS', 'VALIDE', 'PDF_GENERE', 'PARTAGE']
     USER_ROLES = ['super_admin', 'admin', 'valideur', 'demandeur']
 
@@ -26,6 +26,11 @@ from models.role import Role
 from models.permission import Permission
 from models.lexique import LexiqueEntry
 from models.settings import SiteSettings
+from services.lexique_index import lexique_index
+from services.product_search import ProductSearch
+from services.product_service import ProductService
+from services.order_service import OrderService
+from services.lexique_service import LexiqueService
 
 def init_database():
     print("Starting database initialization...")
@@ -38,6 +43,23 @@ def init_database():
         tables_created = 0
         tables_checked = 0
 
+        # The product search index needs pg_trgm before the indexes are created
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.begin() as conn:
+                conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+        # Product references become unique within a company: existing duplicates are
+        # renamed before the index is created, the former non-unique index is dropped
+        if 'products' in existing_tables:
+            try:
+                renamed = ProductService.deduplicate_references()
+                print(f"Duplicate product references renamed: {renamed}")
+                with db.engine.begin() as conn:
+                    conn.execute(text('DROP INDEX IF EXISTS ix_products_company_reference'))
+            except Exception as e:
+                print(f"Error deduplicating product references: {e}")
+                db.session.rollback()
+
         # Iterate over all models defined in SQLAlchemy metadata
         for table_name, table in db.metadata.tables.items():
             if table_name not in existing_tables:
@@ -69,7 +91,42 @@ def init_database():
                         except Exception as e:
                             print(f"Error adding column {column.name} to {table_name}: {e}")
 
+                # Indexes added to the model after the table was created
+                existing_indexes = {i['name'] for i in inspector.get_indexes(table_name)}
+                for index in table.indexes:
+                    if index.name not in existing_indexes:
+                        print(f"Creating index: {index.name} on {table_name}")
+                        try:
+                            index.create(db.engine)
+                        except Exception as e:
+                            print(f"Error creating index {index.name} on {table_name}: {e}")
+
         print(f"Schema verification complete! (Tables created: {tables_created}, Checked: {tables_checked})")
+
+        # Product search: FTS table on existing SQLite databases, search_text backfill
+        try:
+            with db.engine.begin() as conn:
+                updated = ProductSearch.install(conn)
+            print(f"Product search index rebuilt ({updated} products)")
+        except Exception as e:
+            print(f"Error building product search index: {e}")
+            db.session.rollback()
+        
+        # Pending suggestions are matched by normalized term: fill it for older suggestions
+        try:
+            updated = LexiqueService.backfill_normalized_terms()
+            print(f"Normalized terms computed for {updated} lexique suggestions")
+        except Exception as e:
+            print(f"Error computing lexique normalized terms: {e}")
+            db.session.rollback()
+        
+        # Order totals are stored on the order: fill them for orders created before the columns
+        try:
+            fixed = OrderService.recompute_totals(missing_only=True)
+            print(f"Order totals computed for {fixed} orders")
+        except Exception as e:
+            print(f"Error computing order totals: {e}")
+            db.session.rollback()
         
         # Initialize Site Settings
         try:
@@ -129,9 +186,22 @@ def init_database():
                 print("BTP Dictionary populated with initial terms!")
             else:
                 print("Dictionary already populated.")
+                # The dictionary browser pages on usage_count, which must not be NULL
+                LexiqueEntry.query.filter(LexiqueEntry.usage_count.is_(None)).update(
+                    {'usage_count': 0}, synchronize_session=False
+                )
+                db.session.commit()
         except Exception as e:
             print(f"Error checking/populating dictionary: {e}")
 
+        # Workers load the dictionary index from this file instead of the database
+        if app.config.get('LEXIQUE_SNAPSHOT_DIR'):
+            try:
+                path = lexique_index.write_snapshot()
+                print(f"Dictionary snapshot written: {path}")
+            except Exception as e:
+                print(f"Error writing dictionary snapshot: {e}")
+
         print("Database initialization complete!")
 
 def populate_rbac():
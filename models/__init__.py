@@ -11,3 +11,5 @@ from models.product import Product
 from models.order import Order, OrderLine, OrderHistory
 from models.lexique import LexiqueEntry, LexiqueSuggestion
 from models.settings import SiteSettings
+from models.cache_version import CacheVersion
+from models.bc_sequence import BcSequence
@@ -0,0 +1,15 @@
+from datetime import datetime
+from models import db
+
+class BcSequence(db.Model):
+    __tablename__ = 'bc_sequences'
+
+    # One counter per company and year: purchase order numbers restart every year
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BcSequence {self.company_id}/{self.year}={self.last_value}>'
@@ -0,0 +1,14 @@
+from datetime import datetime
+from models import db
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+
+    # One row per in-process cache shared by all workers (e.g. 'lexique')
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
@@ -1,8 +1,15 @@
 from datetime import datetime
+from sqlalchemy import event
 from models import db
+from utils.normalization import DARIJA_LANGUAGES, fold_darija_digits, normalize_term
 
 class LexiqueEntry(db.Model):
     __tablename__ = 'lexique_entries'
+    __table_args__ = (
+        # Keyset pagination of the dictionary (most used first)
+        db.Index('ix_lexique_entries_category_usage', 'category', 'usage_count', 'id'),
+        db.Index('ix_lexique_entries_usage', 'usage_count', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -33,16 +40,21 @@ class LexiqueEntry(db.Model):
     def add_alias(self, alias):
         if not self.aliases:
             self.aliases = []
-        if alias.lower() not in [a.lower() for a in self.aliases]:
+        if normalize_term(alias) not in [normalize_term(a) for a in self.aliases]:
             self.aliases.append(alias)
     
     def matches(self, term):
-        term_lower = term.lower().strip()
+        key = normalize_term(term)
         for lang, translation in (self.translations or {}).items():
-            if translation and translation.lower() == term_lower:
+            if not translation:
+                continue
+            translation_key = normalize_term(translation)
+            if translation_key == key:
+                return True
+            if lang in DARIJA_LANGUAGES and fold_darija_digits(translation_key) == key:
                 return True
         for alias in (self.aliases or []):
-            if alias.lower() == term_lower:
+            if normalize_term(alias) == key:
                 return True
         return False
     
@@ -56,6 +68,10 @@ class LexiqueEntry(db.Model):
 
 class LexiqueSuggestion(db.Model):
     __tablename__ = 'lexique_suggestions'
+    __table_args__ = (
+        # Pending suggestion of a term (suggest_term merges duplicates into it)
+        db.Index('ix_lexique_suggestions_status_term', 'status', 'normalized_term'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -63,6 +79,8 @@ class LexiqueSuggestion(db.Model):
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=True)
     
     original_term = db.Column(db.String(200), nullable=False)
+    # normalize_term(original_term), kept up to date by _update_normalized_term
+    normalized_term = db.Column(db.Text, nullable=True)
     source_language = db.Column(db.String(10), nullable=True)
     
     suggested_translations = db.Column(db.JSON, nullable=False, default=dict)
@@ -86,3 +104,9 @@ class LexiqueSuggestion(db.Model):
     
     def __repr__(self):
         return f'<LexiqueSuggestion {self.original_term}>'
+
+
+@event.listens_for(LexiqueSuggestion, 'before_insert')
+@event.listens_for(LexiqueSuggestion, 'before_update')
+def _update_normalized_term(mapper, connection, target):
+    target.normalized_term = normalize_term(target.original_term)
@@ -1,8 +1,28 @@
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 from models import db
 
+# VAT applied to every order (shown as "TVA (20%)")
+TVA_RATE = Decimal('0.20')
+CENT = Decimal('0.01')
+
+
+def to_decimal(value):
+    """Decimal from a column value or a form float, without binary float noise."""
+    if value is None:
+        return Decimal('0')
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Orders list: newest first per company, optionally by status or project
+        db.Index('ix_orders_company_created', 'company_id', 'created_at'),
+        db.Index('ix_orders_company_status_created', 'company_id', 'status', 'created_at'),
+        db.Index('ix_orders_company_project_created', 'company_id', 'project_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
@@ -29,6 +49,11 @@ class Order(db.Model):
     shared_at = db.Column(db.DateTime, nullable=True)
     share_method = db.Column(db.String(50), nullable=True)
     
+    # Maintained by OrderService on every line change (scripts/recompute_order_totals.py rebuilds them)
+    line_count = db.Column(db.Integer, nullable=False, default=0)
+    total_ht = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    total_ttc = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    
     created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     validated_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     validated_at = db.Column(db.DateTime, nullable=True)
@@ -59,10 +84,15 @@ class Order(db.Model):
         return self.status in ['VALIDE', 'PDF_GENERE', 'PARTAGE']
     
     def get_total(self):
-        total = 0
-        for line in self.lines:
-            total += line.get_subtotal()
-        return total
+        return to_decimal(self.total_ht)
+    
+    @property
+    def total_tva(self):
+        return to_decimal(self.total_ttc) - to_decimal(self.total_ht)
+    
+    @staticmethod
+    def compute_ttc(total_ht):
+        return (to_decimal(total_ht) * (1 + TVA_RATE)).quantize(CENT, rounding=ROUND_HALF_UP)
     
     def __repr__(self):
         return f'<Order {self.bc_number}>'
@@ -91,9 +121,13 @@ class OrderLine(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def get_subtotal(self):
-        if self.unit_price:
-            return float(self.quantity) * float(self.unit_price)
-        return 0
+        return OrderLine.compute_subtotal(self.quantity, self.unit_price)
+    
+    @staticmethod
+    def compute_subtotal(quantity, unit_price):
+        if not unit_price:
+            return Decimal('0.00')
+        return (to_decimal(quantity) * to_decimal(unit_price)).quantize(CENT, rounding=ROUND_HALF_UP)
     
     def __repr__(self):
         return f'<OrderLine {self.line_number}: {self.description}>'
@@ -1,8 +1,19 @@
 from datetime import datetime
+from sqlalchemy import DDL, event
 from models import db
+from utils.normalization import normalize_term
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        # One product per reference within a company: the catalog import upserts on it
+        db.Index('uq_products_company_reference', 'company_id', 'reference', unique=True),
+        # Substring search on PostgreSQL (pg_trgm), SQLite uses the products_fts table
+        db.Index(
+            'ix_products_search_text_trgm', 'search_text',
+            postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
@@ -12,6 +23,9 @@ class Product(db.Model):
     
     labels = db.Column(db.JSON, nullable=False, default=dict)
     
+    # Normalized reference and labels, kept up to date on insert/update for products.search
+    search_text = db.Column(db.Text, nullable=True)
+    
     unit = db.Column(db.String(20), nullable=False, default='unite')
     unit_price = db.Column(db.Numeric(12, 2), nullable=True)
     
@@ -29,9 +43,55 @@ class Product(db.Model):
         return self.reference or f"Product #{self.id}"
     
     def set_label(self, lang, value):
-        if not self.labels:
-            self.labels = {}
-        self.labels[lang] = value
+        # Reassigned rather than mutated so the change is flushed (and search_text rebuilt)
+        self.labels = {**(self.labels or {}), lang: value}
+    
+    @staticmethod
+    def build_search_text(reference, labels):
+        # normalize_term keeps digits: a partial reference (HEA2) stays a prefix of the stored one (hea200)
+        values = [reference] + [label for label in (labels or {}).values()]
+        return ' | '.join(normalize_term(value) for value in values if value)
     
     def __repr__(self):
         return f'<Product {self.reference}>'
+
+
+@event.listens_for(Product, 'before_insert')
+@event.listens_for(Product, 'before_update')
+def _update_search_text(mapper, connection, target):
+    target.search_text = Product.build_search_text(target.reference, target.labels)
+
+
+
+# SQLite has no trigram index: an FTS5 table (trigram tokenizer, SQLite >= 3.34)
+# indexes search_text instead, kept in sync by triggers
+PRODUCTS_FTS_TABLE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "search_text, content='products', content_rowid='id', tokenize='trigram')"
+)
+PRODUCTS_FTS_TRIGGERS = {
+    'products_fts_ai': "AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+    'products_fts_ad': "AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); END",
+    'products_fts_au': "AFTER UPDATE OF search_text ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+    "INSERT INTO products_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+}
+PRODUCTS_FTS_TRIGGERS_DDL = [
+    f"CREATE TRIGGER IF NOT EXISTS {name} {body}" for name, body in PRODUCTS_FTS_TRIGGERS.items()
+]
+# On a new, empty table: the triggers index every row from the start
+PRODUCTS_FTS_DDL = [PRODUCTS_FTS_TABLE_DDL] + PRODUCTS_FTS_TRIGGERS_DDL
+
+
+def supports_products_fts(ddl, target, bind, **kw):
+    return bind.dialect.name == 'sqlite' and bind.dialect.dbapi.sqlite_version_info >= (3, 34)
+
+
+event.listen(Product.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+for _statement in PRODUCTS_FTS_DDL:
+    event.listen(Product.__table__, 'after_create', DDL(_statement).execute_if(callable_=supports_products_fts))
+event.listen(Product.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS products_fts').execute_if(dialect='sqlite'))
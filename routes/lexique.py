@@ -5,7 +5,6 @@
 #  * Auditer par : La CyberConfiance, www.cyberconfiance.com
 #  */
 
-import pandas as pd
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import current_user, login_required
 from models import db
@@ -14,9 +13,13 @@ from security.decorators import super_admin_required, tenant_required
 from services.lexique_service import LexiqueService
 from services.i18n_service import i18n
 from config.settings import Config
+from utils.tabular import SUPPORTED_EXTENSIONS, iter_rows
 
 lexique_bp = Blueprint('lexique', __name__)
 
+# Rows detailed in the flash message after an import
+MAX_REPORTED_ROWS = 5
+
 @lexique_bp.route('/', methods=['GET', 'POST'])
 @login_required
 def index():
@@ -57,27 +60,12 @@ def index():
     category = request.args.get('category', '')
     search = request.args.get('search', '').strip()
     
-    entries = LexiqueEntry.query.filter_by(is_validated=True)
-    
-    if category:
-        entries = entries.filter_by(category=category)
-    
-    if search:
-        entries = entries.all()
-        filtered = []
-        for entry in entries:
-            if entry.matches(search):
-                filtered.append(entry)
-                continue
-            for lang, trans in (entry.translations or {}).items():
-                if trans and search.lower() in trans.lower():
-                    filtered.append(entry)
-                    break
-        entries = filtered
-    else:
-        entries = entries.order_by(LexiqueEntry.usage_count.desc()).all()
+    page = LexiqueService.browse_entries(
+        search=search, category=category, after=request.args.get('after'),
+        per_page=current_app.config.get('LEXIQUE_PAGE_SIZE', 50)
+    )
     
-    return render_template('lexique/index.html', entries=entries, 
+    return render_template('lexique/index.html', entries=page['entries'], page=page,
                          current_category=category, search=search,
                          languages=Config.SUPPORTED_LANGUAGES)
 
@@ -103,6 +91,25 @@ def search():
     
     return jsonify({'found': False, 'confidence': 0})
 
+@lexique_bp.route('/autocomplete')
+@login_required
+def autocomplete():
+    query = request.args.get('q', '').strip()
+    lang = request.args.get('lang') or None
+    limit = min(request.args.get('limit', 10, type=int), current_app.config.get('LEXIQUE_AUTOCOMPLETE_MAX_RESULTS', 20))
+    
+    if lang and lang not in Config.SUPPORTED_LANGUAGES:
+        return jsonify({'error': 'Langue non supportée'}), 400
+    
+    results = LexiqueService.autocomplete(query, lang, max(limit, 1)) if query else []
+    
+    response = jsonify({'results': results})
+    # Revalidated on every use, answered with 304 until the completions change. The ETag
+    # hashes the answer: the usage ranking is refreshed per worker, not versioned globally
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
 @lexique_bp.route('/suggest', methods=['GET', 'POST'])
 @login_required
 @tenant_required
@@ -190,49 +197,28 @@ def bulk_import():
         flash(i18n.translate('Aucun fichier sélectionné.'), 'danger')
         return redirect(url_for('lexique.admin'))
 
-    if not (file.filename.endswith('.csv') or file.filename.endswith('.xlsx')):
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
         flash(i18n.translate('Seuls les fichiers CSV ou Excel (.xlsx) sont acceptés.'), 'danger')
         return redirect(url_for('lexique.admin'))
 
     try:
-        if file.filename.endswith('.csv'):
-             df = pd.read_csv(file, sep=None, engine='python')
-        else:
-             df = pd.read_excel(file)
-
-        # Normalize columns to lowercase
-        df.columns = df.columns.str.lower()
-        # Handle NaN values
-        df = df.fillna('')
+        report = LexiqueService.import_suggestions(
+            iter_rows(file.stream, file.filename),
+            chunk_size=current_app.config.get('LEXIQUE_IMPORT_CHUNK_SIZE', 500)
+        )
 
-        count = 0
-        for row in df.to_dict(orient='records'):
-            # Expected columns: fr, en, ar, dr, category (case insensitive now)
-            translations = {}
-            for lang in Config.SUPPORTED_LANGUAGES:
-                if lang in row and str(row[lang]).strip():
-                    translations[lang] = str(row[lang]).strip()
-
-            if not translations.get('fr'):
-                continue
-
-            category = row.get('category', 'general')
-            if not category or str(category).strip() == '':
-                 category = 'general'
-
-            # Create suggestion to be validated
-            suggestion = LexiqueService.suggest_term(
-                original_term=translations['fr'],
-                suggested_translations=translations,
-                category=category,
-                context="Import en masse",
-                source_language='fr'
+        flash(i18n.translate('{} termes importés dans la file de validation.').format(report['created']), 'success')
+        if report['duplicate'] or report['invalid'] or report['skipped']:
+            details = ', '.join(
+                i18n.translate('ligne {} : {}').format(row['line'], i18n.translate(row['reason']))
+                for row in report['rows'][:MAX_REPORTED_ROWS]
             )
-            count += 1
-
-        flash(i18n.translate('{} termes importés dans la file de validation.').format(count), 'success')
+            flash(i18n.translate('{} doublons, {} lignes invalides, {} lignes vides ignorés. {}').format(
+                report['duplicate'], report['invalid'], report['skipped'], details
+            ), 'warning')
 
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Import Error: {e}")
         flash(i18n.translate('Erreur lors de l\'import: {}').format(str(e)), 'danger')
 
@@ -252,6 +238,36 @@ def reject_suggestion(suggestion_id):
     
     return redirect(url_for('lexique.admin'))
 
+@lexique_bp.route('/admin/suggestions/bulk', methods=['POST'])
+@login_required
+@super_admin_required
+def bulk_moderate():
+    action = request.form.get('action')
+    category = request.form.get('category', '')
+    # 'all' applies the action to every pending suggestion of the category filter
+    if request.form.get('scope') == 'all':
+        suggestion_ids = None
+    else:
+        suggestion_ids = request.form.getlist('suggestion_ids', type=int)
+        if not suggestion_ids:
+            flash(i18n.translate('Aucune suggestion sélectionnée.'), 'danger')
+            return redirect(url_for('lexique.admin'))
+
+    try:
+        if action == 'approve':
+            entries = LexiqueService.approve_many(suggestion_ids, category)
+            flash(i18n.translate('{} suggestions approuvées.').format(len(entries)), 'success')
+        elif action == 'reject':
+            count = LexiqueService.reject_many(suggestion_ids, category, request.form.get('notes', ''))
+            flash(i18n.translate('{} suggestions rejetées.').format(count), 'info')
+        else:
+            flash(i18n.translate('Action inconnue.'), 'danger')
+    except Exception as e:
+        db.session.rollback()
+        flash(i18n.translate('Erreur: {}').format(str(e)), 'danger')
+
+    return redirect(url_for('lexique.admin'))
+
 @lexique_bp.route('/admin/entry/add', methods=['GET', 'POST'])
 @login_required
 @super_admin_required
@@ -9,6 +9,7 @@ import os
 from datetime import datetime
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, send_file, current_app
 from flask_login import current_user, login_required
+from sqlalchemy.orm import contains_eager, joinedload
 from models import db
 from models.order import Order, OrderLine, OrderHistory
 from models.project import Project
@@ -22,37 +23,79 @@ from services.i18n_service import i18n
 
 orders_bp = Blueprint('orders', __name__)
 
-@orders_bp.route('/')
-@login_required
-@tenant_required
-def index():
+def _filtered_orders():
     status = request.args.get('status', '')
-    project_id = request.args.get('project_id', '')
+    project_id = request.args.get('project_id', type=int)
     
     orders = TenantService.get_tenant_orders()
     
     if status:
         orders = orders.filter_by(status=status)
     if project_id:
-        orders = orders.filter_by(project_id=int(project_id))
-    
-    orders = orders.order_by(Order.created_at.desc()).all()
+        orders = orders.filter_by(project_id=project_id)
+    return orders
+
+def _orders_page(orders):
+    # Project and company come with each order (one query), totals are stored on the order
+    return OrderService.list_orders(
+        orders.options(joinedload(Order.project), joinedload(Order.company)),
+        sort=request.args.get('sort', 'date'),
+        direction=request.args.get('direction', 'desc'),
+        after=request.args.get('after'),
+        per_page=current_app.config.get('ORDERS_PAGE_SIZE', 50)
+    )
+
+@orders_bp.route('/')
+@login_required
+@tenant_required
+def index():
+    orders = _filtered_orders()
+    page = _orders_page(orders)
+    status_counts = OrderService.count_by_status(orders)
     projects = TenantService.get_tenant_projects().all()
     
     # Recent Activity (Global for tenant)
     recent_history = OrderHistory.query.join(Order).filter(
         Order.company_id == current_user.company_id
-    ).order_by(OrderHistory.created_at.desc()).limit(10).all()
+    ).options(contains_eager(OrderHistory.order)).order_by(OrderHistory.created_at.desc()).limit(10).all()
+
+    return render_template('orders/index.html', orders=page['orders'], next_cursor=page['next_cursor'],
+                         status_counts=status_counts, projects=projects,
+                         current_status=request.args.get('status', ''),
+                         current_project=request.args.get('project_id', type=int),
+                         current_sort=request.args.get('sort', 'date'),
+                         current_direction=request.args.get('direction', 'desc'),
+                         recent_history=recent_history)
 
-    return render_template('orders/index.html', orders=orders, projects=projects, 
-                         current_status=status, current_project=project_id, recent_history=recent_history)
+@orders_bp.route('/page')
+@login_required
+@tenant_required
+def page():
+    """Next page of the orders list, for infinite scrolling."""
+    result = _orders_page(_filtered_orders())
+    return jsonify({
+        'orders': [
+            {
+                'id': order.id,
+                'bc_number': order.bc_number,
+                'project': order.project.name,
+                'supplier_name': order.supplier_name,
+                'status': order.status,
+                'created_at': order.created_at.isoformat(),
+                'total_ht': str(order.total_ht),
+                'currency': order.company.currency or 'MAD'
+            }
+            for order in result['orders']
+        ],
+        'html': render_template('orders/_rows.html', orders=result['orders']),
+        'next_cursor': result['next_cursor']
+    })
 
 @orders_bp.route('/create', methods=['GET', 'POST'])
 @login_required
 @tenant_required
 def create():
     projects = TenantService.get_tenant_projects().all()
-    products = TenantService.get_tenant_products().all()
     
     if request.method == 'POST':
         project_id = request.form.get('project_id')
@@ -68,12 +111,12 @@ def create():
         
         if not project_id:
             flash(i18n.translate('Veuillez sélectionner un chantier.'), 'danger')
-            return render_template('orders/create.html', projects=projects, products=products)
+            return render_template('orders/create.html', projects=projects)
         
         project = Project.query.get(project_id)
         if not project or not TenantService.validate_tenant_access(project):
             flash(i18n.translate('Chantier non valide.'), 'danger')
-            return render_template('orders/create.html', projects=projects, products=products)
+            return render_template('orders/create.html', projects=projects)
         
         requested_date = None
         if requested_date_str:
@@ -103,7 +146,7 @@ def create():
             current_app.logger.error(f"Error creating order: {e}")
             flash(i18n.translate('Une erreur est survenue lors de la création.'), 'danger')
     
-    return render_template('orders/create.html', projects=projects, products=products)
+    return render_template('orders/create.html', projects=projects)
 
 @orders_bp.route('/<int:order_id>')
 @login_required
@@ -134,7 +177,6 @@ def edit(order_id):
         flash(i18n.translate('Vous ne pouvez pas modifier ce bon de commande.'), 'warning')
         return redirect(url_for('orders.view', order_id=order.id))
     
-    products = TenantService.get_tenant_products().all()
     lines = order.lines.order_by(OrderLine.line_number).all()
     
     if request.method == 'POST':
@@ -171,7 +213,7 @@ def edit(order_id):
             if not description:
                 flash(i18n.translate('La description est obligatoire.'), 'danger')
             else:
-                translation_result = LexiqueService.translate(description)
+                translation_result = LexiqueService.translate_line(description)
                 
                 try:
                     OrderService.add_line(
@@ -194,7 +236,7 @@ def edit(order_id):
         
         return redirect(url_for('orders.edit', order_id=order.id))
     
-    return render_template('orders/edit.html', order=order, lines=lines, products=products)
+    return render_template('orders/edit.html', order=order, lines=lines)
 
 @orders_bp.route('/<int:order_id>/line/<int:line_id>/delete', methods=['POST'])
 @login_required
@@ -371,3 +413,25 @@ def translate_term():
     except Exception as e:
         current_app.logger.error(f"Error translating: {e}")
         return jsonify({'error': 'Translation failed'}), 500
+
+@orders_bp.route('/translate/batch', methods=['POST'])
+@login_required
+@tenant_required
+def translate_terms():
+    data = request.get_json(silent=True) or {}
+    terms = data.get('terms', [])
+    to_lang = data.get('to_lang', 'fr')
+
+    if not isinstance(terms, list) or not all(isinstance(term, str) for term in terms):
+        return jsonify({'error': 'terms must be a list of strings'}), 400
+
+    max_terms = current_app.config.get('LEXIQUE_BATCH_MAX_TERMS', 500)
+    if len(terms) > max_terms:
+        return jsonify({'error': f'Too many terms (max {max_terms})'}), 400
+
+    try:
+        results = LexiqueService.translate_many(terms, to_lang=to_lang)
+        return jsonify({'results': results})
+    except Exception as e:
+        current_app.logger.error(f"Error translating batch: {e}")
+        return jsonify({'error': 'Translation failed'}), 500
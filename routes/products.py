@@ -5,18 +5,25 @@
 #  * Auditer par : La CyberConfiance, www.cyberconfiance.com
 #  */
 
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from datetime import datetime
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, Response, stream_with_context
 from flask_login import current_user, login_required
-from sqlalchemy import or_
 from models import db
 from models.product import Product
 from services.i18n_service import i18n
 from security.decorators import tenant_required, admin_required
 from services.tenant_service import TenantService
+from services.product_search import ProductSearch
+from services.product_catalog import product_catalog
+from services.product_service import ProductService
 from config.settings import Config
+from utils.tabular import SUPPORTED_EXTENSIONS, iter_rows
 
 products_bp = Blueprint('products', __name__)
 
+# Rejected rows detailed in the import report message
+MAX_REPORTED_ROWS = 5
+
 @products_bp.route('/')
 @login_required
 @tenant_required
@@ -37,7 +44,7 @@ def index():
 @admin_required
 def add():
     if request.method == 'POST':
-        reference = request.form.get('reference', '').strip()
+        reference = request.form.get('reference', '').strip() or None
         category = request.form.get('category', 'materiau')
         unit = request.form.get('unit', 'unite')
         unit_price = request.form.get('unit_price', '')
@@ -52,6 +59,10 @@ def add():
             flash(i18n.translate('Le libellé en français est obligatoire.'), 'danger')
             return render_template('products/form.html', product=None, languages=Config.SUPPORTED_LANGUAGES)
         
+        if reference and ProductService.reference_taken(current_user.company_id, reference):
+            flash(i18n.translate('Cette référence est déjà utilisée par un autre article.'), 'danger')
+            return render_template('products/form.html', product=None, languages=Config.SUPPORTED_LANGUAGES)
+        
         product = Product(
             company_id=current_user.company_id,
             reference=reference,
@@ -82,7 +93,13 @@ def edit(product_id):
         return redirect(url_for('products.index'))
     
     if request.method == 'POST':
-        product.reference = request.form.get('reference', '').strip()
+        # Checked before the product is modified: the query would flush the duplicate
+        reference = request.form.get('reference', '').strip() or None
+        if reference and ProductService.reference_taken(product.company_id, reference, product.id):
+            flash(i18n.translate('Cette référence est déjà utilisée par un autre article.'), 'danger')
+            return render_template('products/form.html', product=product, languages=Config.SUPPORTED_LANGUAGES)
+        
+        product.reference = reference
         product.category = request.form.get('category', 'materiau')
         product.unit = request.form.get('unit', 'unite')
         unit_price = request.form.get('unit_price', '')
@@ -129,25 +146,80 @@ def delete(product_id):
     
     return redirect(url_for('products.index'))
 
+@products_bp.route('/import', methods=['POST'])
+@login_required
+@tenant_required
+@admin_required
+def bulk_import():
+    if not current_user.company_id:
+        flash(i18n.translate('Votre compte n\'est associé à aucune société.'), 'danger')
+        return redirect(url_for('products.index'))
+    
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        flash(i18n.translate('Aucun fichier sélectionné.'), 'danger')
+        return redirect(url_for('products.index'))
+    
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        flash(i18n.translate('Seuls les fichiers CSV ou Excel (.xlsx) sont acceptés.'), 'danger')
+        return redirect(url_for('products.index'))
+    
+    try:
+        report = ProductService.import_catalog(
+            iter_rows(file.stream, file.filename),
+            current_user.company_id,
+            chunk_size=current_app.config.get('PRODUCT_IMPORT_CHUNK_SIZE', 500)
+        )
+        
+        flash(i18n.translate('{} articles créés, {} articles mis à jour.').format(
+            report['created'], report['updated']
+        ), 'success')
+        if report['invalid'] or report['skipped']:
+            details = ', '.join(
+                i18n.translate('ligne {} : {}').format(row['line'], i18n.translate(row['reason']))
+                for row in report['rows'][:MAX_REPORTED_ROWS]
+            )
+            flash(i18n.translate('{} lignes invalides, {} lignes vides ignorées. {}').format(
+                report['invalid'], report['skipped'], details
+            ), 'warning')
+    
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Product import error: {e}")
+        flash(i18n.translate('Erreur lors de l\'import: {}').format(str(e)), 'danger')
+    
+    return redirect(url_for('products.index'))
+
+@products_bp.route('/export')
+@login_required
+@tenant_required
+def export():
+    company_id = current_user.company_id
+    if current_user.role == 'super_admin':
+        company_id = request.args.get('company_id', type=int) or company_id
+    
+    if not company_id:
+        flash(i18n.translate('Votre compte n\'est associé à aucune société.'), 'danger')
+        return redirect(url_for('products.index'))
+    
+    # Streamed: the catalog is written as it is read from the database
+    return Response(
+        stream_with_context(ProductService.export_catalog(company_id)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=catalogue-{datetime.utcnow():%Y%m%d}.csv'}
+    )
+
 @products_bp.route('/search')
 @login_required
 @tenant_required
 def search():
-    query = request.args.get('q', '').strip().lower()
+    query = request.args.get('q', '').strip()
     
     if not query or len(query) < 2:
         return jsonify([])
     
-    # Optimization: Filter in database instead of memory
-    base_query = TenantService.get_tenant_products()
-    
-    # We iterate over SUPPORTED_LANGUAGES to check values.
-    # This avoids casting the whole JSON to text which would match keys (e.g. 'fr').
-    conditions = [Product.reference.ilike(f'%{query}%')]
-    for lang in Config.SUPPORTED_LANGUAGES:
-        conditions.append(Product.labels[lang].astext.ilike(f'%{query}%'))
-
-    products = base_query.filter(or_(*conditions)).limit(20).all()
+    # Indexed search over the normalized reference and labels (accents and case ignored)
+    products = ProductSearch.filter(TenantService.get_tenant_products(), query).limit(20).all()
 
     results = [
         {
@@ -162,3 +234,23 @@ def search():
     ]
     
     return jsonify(results)
+
+@products_bp.route('/catalog')
+@login_required
+@tenant_required
+def catalog():
+    company_id = current_user.company_id
+    # A super admin reads the catalog of the company whose order is edited
+    if current_user.role == 'super_admin':
+        company_id = request.args.get('company_id', type=int) or company_id
+    
+    if not company_id:
+        return jsonify({'products': []})
+    
+    version, payload = product_catalog.get(company_id)
+    
+    response = current_app.response_class(payload, mimetype='application/json')
+    # Revalidated on every page load, answered with 304 until a product changes
+    response.set_etag(f'catalog-{company_id}-{version}')
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
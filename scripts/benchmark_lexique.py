@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# /* * Nom de l'application : BTP Commande
+#  * Description : Banc d'essai des recherches dans le dictionnaire
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+"""
+Benchmarks dictionary lookups on synthetic dictionaries.
+
+    python scripts/benchmark_lexique.py                       # 1k, 10k, 100k entries
+    python scripts/benchmark_lexique.py --sizes 1000 --queries 500
+    python scripts/benchmark_lexique.py --save-baseline       # store the reference numbers
+    python scripts/benchmark_lexique.py --check               # exit 1 on regression
+
+Every operation (LexiqueService.search, translate, the dictionary browser
+search and autocomplete) replays the same query mix: exact translations,
+aliases, substrings and misses, after WARMUP_QUERIES unmeasured ones.
+Reported per operation: p50/p99 latency, queries per second, SQL
+statements per query and the speedup over REFERENCE_OPERATION, a plain SQL
+scan measured in the same run.
+
+Latencies depend on the machine: --check only compares SQL statements per
+query and speedups, and the baseline file only stores those. They depend
+on the number of queries replayed (result caches), so --check replays the
+query count and seed the baseline was recorded with.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_lexique_baseline.json')
+
+# Queries run before the measured ones, to pay one-time costs (index build, first reads)
+WARMUP_QUERIES = 20
+
+# Extra SQL statements per query tolerated by --check: the periodic reads of the
+# cache versions (CACHE_VERSION_CHECK_INTERVAL) depend on how long the run takes
+SQL_PER_QUERY_SLACK = 0.01
+
+# Operation the others are compared to: a substring scan of the translations in
+# SQL, the lookup the dictionary index replaces. It runs on the same machine in
+# the same run, so speedups over it can be compared across machines.
+REFERENCE_OPERATION = 'sql_scan'
+
+# Workload queries replayed by the reference operation (one scan per query is slow on large dictionaries)
+REFERENCE_QUERIES = 200
+
+# Metrics stored in the baseline and compared by --check
+BASELINE_METRICS = ('sql_per_query', 'speedup')
+
+# Share of each kind of query in the replayed mix
+QUERY_MIX = {'exact': 0.4, 'alias': 0.2, 'substring': 0.25, 'miss': 0.15}
+
+_LATIN_SYLLABLES = ['ba', 'be', 'ci', 'do', 'fa', 'ge', 'ka', 'la', 'ma', 'ne', 'po', 'ra', 'si', 'ta', 'tu', 'vo', 'za']
+_DARIJA_SYLLABLES = ['3a', '7a', 'bo', 'dr', 'gh', 'kh', 'la', 'ma', '9a', 'ra', 'si', 'za']
+_ARABIC_LETTERS = 'ابتثجحخدذرزسشصضطظعغفقكلمنهوي'
+_CATEGORIES = ['materiau', 'materiel', 'general', 'administratif']
+
+
+def _word(rng, syllables, low=2, high=4):
+    return ''.join(rng.choice(syllables) for _ in range(rng.randint(low, high)))
+
+
+def _phrase(rng, syllables, words=None):
+    return ' '.join(_word(rng, syllables) for _ in range(words or rng.randint(1, 3)))
+
+
+def generate_entries(size, seed=0):
+    """Synthetic multilingual entries, as dicts ready for a bulk INSERT."""
+    rng = random.Random(seed)
+    entries = []
+    for i in range(size):
+        fr = f'{_phrase(rng, _LATIN_SYLLABLES).capitalize()} {i}'
+        entries.append({
+            'category': rng.choice(_CATEGORIES),
+            'translations': {
+                'fr': fr,
+                'en': _phrase(rng, _LATIN_SYLLABLES).capitalize(),
+                'ar': ' '.join(''.join(rng.choice(_ARABIC_LETTERS) for _ in range(rng.randint(3, 6)))
+                               for _ in range(rng.randint(1, 2))),
+                'dr': _phrase(rng, _DARIJA_SYLLABLES),
+            },
+            'aliases': [_phrase(rng, _LATIN_SYLLABLES, 1) for _ in range(rng.randint(0, 2))],
+            'is_validated': True,
+            'usage_count': int(rng.paretovariate(1.2)) - 1,
+        })
+    return entries
+
+
+def generate_queries(entries, count, seed=0):
+    """(kind, term) pairs following QUERY_MIX, drawn from the generated entries."""
+    rng = random.Random(seed + 1)
+    kinds = rng.choices(list(QUERY_MIX), weights=list(QUERY_MIX.values()), k=count)
+    queries = []
+    for kind in kinds:
+        entry = rng.choice(entries)
+        if kind == 'exact':
+            term = entry['translations'][rng.choice(['fr', 'en', 'ar', 'dr'])]
+        elif kind == 'alias':
+            term = rng.choice(entry['aliases']) if entry['aliases'] else entry['translations']['fr']
+        elif kind == 'substring':
+            text = entry['translations']['fr']
+            start = rng.randint(0, max(0, len(text) - 4))
+            term = text[start:start + rng.randint(3, 6)]
+        else:
+            term = 'xq' + _word(rng, ['wy', 'qx', 'jv'])
+        queries.append((kind, term))
+    return queries
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _populate(entries, chunk_size=5000):
+    from sqlalchemy import delete, insert
+    from models import db
+    from models.lexique import LexiqueEntry
+    from services.lexique_index import lexique_index
+
+    db.session.execute(delete(LexiqueEntry))
+    for start in range(0, len(entries), chunk_size):
+        db.session.execute(insert(LexiqueEntry), entries[start:start + chunk_size])
+    db.session.commit()
+    # Bulk statements bypass the session events that normally invalidate the index
+    lexique_index.invalidate()
+
+
+def _sql_scan(term):
+    from sqlalchemy import String, cast, select
+    from models import db
+    from models.lexique import LexiqueEntry
+
+    return db.session.execute(
+        select(LexiqueEntry.id)
+        .where(LexiqueEntry.is_validated.is_(True), cast(LexiqueEntry.translations, String).ilike(f'%{term}%'))
+        .limit(1)
+    ).first()
+
+
+def _operations():
+    from services.lexique_service import LexiqueService
+
+    return {
+        REFERENCE_OPERATION: _sql_scan,
+        'search': lambda term: LexiqueService.search(term),
+        'translate': lambda term: LexiqueService.translate(term, to_lang='en'),
+        'browse': lambda term: LexiqueService.browse_entries(search=term),
+        'autocomplete': lambda term: LexiqueService.autocomplete(term[:3]),
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, queries=2000, seed=0, log=print):
+    """
+    Runs every operation against each dictionary size. Must be called in an
+    application context on a database the benchmark may overwrite.
+    Returns {size: {operation: metrics}} with sizes as strings (JSON keys).
+    The reference operation only replays the first REFERENCE_QUERIES queries.
+    """
+    from sqlalchemy import event
+    from models import db
+    from services.lexique_index import lexique_index
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    results = {}
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+        for size in sizes:
+            entries = generate_entries(size, seed)
+            started = time.perf_counter()
+            _populate(entries)
+            log(f"{size} entries inserted in {time.perf_counter() - started:.2f}s")
+
+            started = time.perf_counter()
+            # A miss also builds the typo-tolerance structures, built lazily otherwise
+            lexique_index.search('xqwarmup')
+            log(f"Index built in {time.perf_counter() - started:.2f}s")
+
+            workload = generate_queries(entries, queries, seed)
+            warmup = generate_queries(entries, WARMUP_QUERIES, seed + 1)
+            results[str(size)] = {}
+            medians = {}
+            for name, operation in _operations().items():
+                replayed = workload[:REFERENCE_QUERIES] if name == REFERENCE_OPERATION else workload
+                for kind, term in warmup:
+                    operation(term)
+                latencies = []
+                del statements[:]
+                started = time.perf_counter()
+                for kind, term in replayed:
+                    query_started = time.perf_counter()
+                    operation(term)
+                    latencies.append(time.perf_counter() - query_started)
+                elapsed = time.perf_counter() - started
+                db.session.rollback()
+
+                medians[name] = _percentile(latencies, 0.50)
+                results[str(size)][name] = {
+                    'p50_ms': round(medians[name] * 1000, 3),
+                    'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+                    'qps': round(len(replayed) / elapsed, 1),
+                    'sql_per_query': round(len(statements) / len(replayed), 3),
+                    'speedup': round(medians[REFERENCE_OPERATION] / medians[name], 1),
+                }
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+    return results
+
+
+def print_report(results, out=sys.stdout):
+    out.write(f"{'size':>8} {'operation':<14} {'p50 ms':>9} {'p99 ms':>9} {'qps':>10} {'sql/q':>7} {'speedup':>8}\n")
+    for size, operations in results.items():
+        for name, metrics in operations.items():
+            out.write(f"{size:>8} {name:<14} {metrics['p50_ms']:>9.3f} {metrics['p99_ms']:>9.3f} "
+                      f"{metrics['qps']:>10.1f} {metrics['sql_per_query']:>7.3f} {metrics['speedup']:>8.1f}\n")
+
+
+def load_baseline(path):
+    """Returns (settings, results) of a baseline file, settings being the queries and seed it was run with."""
+    with open(path) as f:
+        baseline = json.load(f)
+    return {'queries': baseline['queries'], 'seed': baseline['seed']}, baseline['results']
+
+
+def save_baseline(path, results, queries, seed):
+    """Writes the machine-independent metrics (BASELINE_METRICS) of results."""
+    results = {
+        size: {name: {key: metrics[key] for key in BASELINE_METRICS} for name, metrics in operations.items()}
+        for size, operations in results.items()
+    }
+    with open(path, 'w') as f:
+        json.dump({'queries': queries, 'seed': seed, 'results': results}, f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions of results against baseline: a speedup over the reference
+    operation more than tolerance times lower than the baseline's, or more
+    SQL statements per query. Sizes and operations missing from either side
+    are ignored.
+    """
+    regressions = []
+    for size, operations in results.items():
+        for name, metrics in operations.items():
+            reference = baseline.get(size, {}).get(name)
+            if not reference:
+                continue
+            if metrics['speedup'] * tolerance < reference['speedup']:
+                regressions.append(f"{size} {name} speedup: {metrics['speedup']} < {reference['speedup']} / {tolerance}")
+            if metrics['sql_per_query'] > reference['sql_per_query'] + SQL_PER_QUERY_SLACK:
+                regressions.append(f"{size} {name} sql_per_query: "
+                                   f"{metrics['sql_per_query']} > {reference['sql_per_query']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--queries', type=int,
+                        help='queries replayed per operation (default: 2000, or the baseline\'s with --check)')
+    parser.add_argument('--seed', type=int, help='(default: 0, or the baseline\'s with --check)')
+    parser.add_argument('--database-url', default='sqlite:///:memory:',
+                        help='database to benchmark on, its dictionary table is overwritten')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline')
+    parser.add_argument('--check', action='store_true', help='exit 1 on a regression against --baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='allowed loss of speedup (ratio) against the baseline in --check mode')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.check:
+        settings, baseline = load_baseline(args.baseline)
+        for name, value in settings.items():
+            if getattr(args, name) is None:
+                setattr(args, name, value)
+            elif getattr(args, name) != value:
+                # Cache hits, and so SQL per query, depend on the replayed mix: only compare like for like
+                parser.error(f"--{name} {getattr(args, name)} differs from the baseline ({value})")
+    if args.queries is None:
+        args.queries = 2000
+    if args.seed is None:
+        args.seed = 0
+
+    os.environ['DATABASE_URL'] = args.database_url
+    from app import create_app
+    from models import db
+    from services.lexique_index import lexique_index
+
+    app = create_app()
+    # Measure the in-memory index, never a snapshot left by another run
+    lexique_index.snapshot_dir = None
+    with app.app_context():
+        db.create_all()
+        results = run_benchmark(args.sizes, args.queries, args.seed)
+
+    print_report(results)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results, args.queries, args.seed)
+        print(f"Baseline written to {args.baseline}")
+
+    if args.check:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regression against the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
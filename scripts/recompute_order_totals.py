@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# /* * Nom de l'application : BTP Commande
+#  * Description : Recalcul des totaux stockés des bons de commande
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+"""
+Recomputes the line count, total HT and total TTC stored on every order
+from its lines, e.g. after lines were changed outside OrderService.
+
+    python scripts/recompute_order_totals.py
+    python scripts/recompute_order_totals.py --company-id 3
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--company-id', type=int, help='only the orders of this company')
+    parser.add_argument('--batch-size', type=int, default=500, help='orders updated per transaction')
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    from services.order_service import OrderService
+
+    app = create_app()
+    with app.app_context():
+        fixed = OrderService.recompute_totals(company_id=args.company_id, batch_size=args.batch_size)
+    print(f"Totals corrected on {fixed} orders.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,542 @@
+# /* * Nom de l'application : BTP Commande
+#  * Description : Index mémoire du dictionnaire BTP
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db
+from models.lexique import LexiqueEntry
+from utils.cache import LRUCache
+from utils.normalization import DARIJA_LANGUAGES, fold_darija_digits, is_quantity, normalize_term
+from services.lexique_snapshot import read_snapshot, write_snapshot
+from services.version_stamp import VersionStamp
+
+# Scores reported by LexiqueService.search for each kind of match
+SCORE_EXACT = 1.0
+SCORE_TRANSLATION = 0.8
+SCORE_ALIAS = 0.7
+# Fuzzy matches lose SCORE_FUZZY_STEP per edit after the first one
+SCORE_FUZZY = 0.6
+SCORE_FUZZY_STEP = 0.1
+
+GRAM_SIZE = 3
+
+# Deletion variants are only generated on this many leading characters (SymSpell prefix)
+FUZZY_PREFIX_LENGTH = 7
+DEFAULT_FUZZY_MAX_DISTANCE = 2
+
+# Key marking the end of a surface form in the phrase trie (tokens are never empty)
+_PHRASE_END = ''
+_WORD_RE = re.compile(r'\S+')
+
+
+def _grams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _is_punctuation(char):
+    return unicodedata.category(char)[0] in 'PS'
+
+
+def split_tokens(text):
+    """
+    Yields (start, end, key) for every word of text: offsets point into text
+    with surrounding punctuation excluded, key is the normalized word.
+    """
+    for match in _WORD_RE.finditer(text):
+        start, end = match.span()
+        while start < end and _is_punctuation(text[start]):
+            start += 1
+        while end > start and _is_punctuation(text[end - 1]):
+            end -= 1
+        key = normalize_term(text[start:end])
+        if key:
+            yield start, end, key
+
+
+def _deletes(word, distance):
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+def _allowed_distance(term, max_distance):
+    # Short words are too close to each other to tolerate typos
+    if len(term) <= 3:
+        return 0
+    if len(term) <= 5:
+        return min(1, max_distance)
+    return max_distance
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance between a and b (insertions, deletions,
+    substitutions and adjacent transpositions). Returns max_distance + 1 as
+    soon as the distance is known to exceed max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous_previous is not None and j > 1 and
+                    a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class _IndexData:
+    """Immutable once built: readers never take the index lock."""
+
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        # normalized surface -> id of the first entry using it
+        self.exact = {}
+        # (normalized surface, entry id, score) for every translation and alias
+        self.surfaces = []
+        # n-gram (1 to GRAM_SIZE chars) -> positions in self.surfaces
+        self.grams = {}
+        # token trie over every surface, the first entry id using a phrase sits under _PHRASE_END
+        self.phrases = {}
+        # (normalized surface, entry id, language or None for aliases, text) sorted for prefix lookups
+        self.completions = []
+        # entry id -> (usage count when built, category, translations)
+        self.entries = {}
+        # deletion variant of a surface prefix -> positions in self.surfaces,
+        # the costly part: built on the first fuzzy query, or loaded with the snapshot
+        self._deletes = None
+        self._deletes_lock = threading.Lock()
+
+    def add_entry(self, entry_id, usage_count, category, translations):
+        self.entries[entry_id] = (usage_count or 0, category, translations)
+
+    def add_surface(self, text, entry_id, score, lang=None):
+        surface = normalize_term(text)
+        if not surface:
+            return
+        self._add_key(surface, text, entry_id, score, lang)
+        if lang in DARIJA_LANGUAGES:
+            # Darija is also found written without digit letters (l7ajar -> lhajar)
+            folded = fold_darija_digits(surface)
+            if folded != surface:
+                self._add_key(folded, text, entry_id, score, lang)
+
+    def _add_key(self, surface, text, entry_id, score, lang):
+        self.exact.setdefault(surface, entry_id)
+        self.completions.append((surface, entry_id, lang, text))
+
+        position = len(self.surfaces)
+        self.surfaces.append((surface, entry_id, score))
+        for n in range(1, GRAM_SIZE + 1):
+            for gram in _grams(surface, n):
+                self.grams.setdefault(gram, []).append(position)
+
+        node = self.phrases
+        for start, end, key in split_tokens(surface):
+            node = node.setdefault(key, {})
+        if node is not self.phrases:
+            node.setdefault(_PHRASE_END, entry_id)
+
+    def to_state(self):
+        # Only plain containers: the snapshot file is written with marshal.
+        # The deletion variants are included, workers loading it never build them
+        return (self.exact, self.surfaces, self.grams, self.phrases, self.completions, self.entries,
+                self.max_distance, self.get_deletes())
+
+    @classmethod
+    def from_state(cls, state, max_distance):
+        data = cls(max_distance)
+        (data.exact, data.surfaces, data.grams, data.phrases, data.completions, data.entries,
+         deletes_distance, deletes) = state
+        # Variants generated for another LEXIQUE_FUZZY_MAX_DISTANCE are rebuilt on first use
+        if deletes_distance == max_distance:
+            data._deletes = deletes
+        return data
+
+    def get_deletes(self):
+        if self._deletes is None:
+            with self._deletes_lock:
+                if self._deletes is None:
+                    deletes = {}
+                    for position, (surface, entry_id, score) in enumerate(self.surfaces):
+                        for variant in _deletes(surface[:FUZZY_PREFIX_LENGTH], self.max_distance):
+                            deletes.setdefault(variant, []).append(position)
+                    self._deletes = deletes
+        return self._deletes
+
+
+class LexiqueIndex:
+    """
+    Process-wide lookup index over validated dictionary entries.
+    Built lazily on first use and dropped whenever the dictionary changes,
+    in this worker or, through the shared 'lexique' version stamp, in another.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._data = None
+        # Shared version the local generation was last synchronized with
+        self.stamp = VersionStamp('lexique')
+        self._stamp_value = None
+        self.max_distance = DEFAULT_FUZZY_MAX_DISTANCE
+        # Directory of the binary snapshots shared by the workers, disabled when None
+        self.snapshot_dir = None
+        # Translation results, keys start with the dictionary version they were computed for
+        self.translation_cache = LRUCache()
+        # Usage counts used by the rankings, read from the database apart from the index:
+        # hits are written behind (LexiqueUsageCounter) and do not change the dictionary version
+        self.usage_refresh_interval = 60.0
+        self._usage = None
+        self._usage_read_at = 0.0
+        # Incremented on every read of the usage counts, part of the cache keys of the rankings
+        self.usage_version = 0
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_distance = app.config.get('LEXIQUE_FUZZY_MAX_DISTANCE', self.max_distance)
+        self.snapshot_dir = app.config.get('LEXIQUE_SNAPSHOT_DIR')
+        self.usage_refresh_interval = app.config.get('LEXIQUE_USAGE_REFRESH_INTERVAL', self.usage_refresh_interval)
+        self.translation_cache.configure(
+            maxsize=app.config.get('LEXIQUE_CACHE_SIZE', 2048),
+            ttl=app.config.get('LEXIQUE_CACHE_TTL')
+        )
+        self.stamp.init_app(app)
+        # A new application means a new database: never reuse a previous index
+        self.invalidate()
+
+    @property
+    def version(self):
+        """Dictionary version, incremented on every change to LexiqueEntry."""
+        self._sync()
+        return self._generation
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._data = None
+            self._stamp_value = None
+            self._usage = None
+        self.translation_cache.clear()
+        self.stamp.expire()
+
+    def _sync(self):
+        # Drops the local index and cache when another worker changed the dictionary
+        value = self.stamp.current()
+        if value == self._stamp_value:
+            return
+        with self._lock:
+            if value == self._stamp_value:
+                return
+            self._stamp_value = value
+            self._generation += 1
+            self._data = None
+        self.translation_cache.clear()
+
+    def usage_counts(self):
+        """
+        {entry id: usage count} of the validated entries, as ranked by
+        complete and the dictionary browser. Read from the database at most
+        every usage_refresh_interval seconds, and again after this worker
+        flushed its pending hits (expire_usage).
+        """
+        with self._lock:
+            usage = self._usage
+            if usage is not None and time.monotonic() - self._usage_read_at < self.usage_refresh_interval:
+                return usage
+
+        rows = db.session.execute(
+            select(LexiqueEntry.id, LexiqueEntry.usage_count).where(LexiqueEntry.is_validated == True)
+        )
+        usage = {entry_id: usage_count or 0 for entry_id, usage_count in rows}
+        with self._lock:
+            self._usage = usage
+            self._usage_read_at = time.monotonic()
+            self.usage_version += 1
+        return usage
+
+    def expire_usage(self):
+        with self._lock:
+            self._usage = None
+
+    def lookup(self, term):
+        """Returns the id of the entry whose translation or alias equals term, or None."""
+        key = normalize_term(term)
+        if not key:
+            return None
+        return self._get_data().exact.get(key)
+
+    def search(self, term, limit=None, fuzzy=True):
+        """
+        Returns ranked (entry_id, score) candidates for term: exact matches
+        first, then entries containing term in a translation, then in an alias.
+        When nothing contains term, falls back to typo-tolerant matches.
+        """
+        key = normalize_term(term)
+        if not key:
+            return []
+        data = self._get_data()
+
+        exact_id = data.exact.get(key)
+        if exact_id is not None and limit == 1:
+            return [(exact_id, SCORE_EXACT)]
+
+        # Scan the rarest n-gram's posting list and verify each candidate
+        n = min(GRAM_SIZE, len(key))
+        postings = []
+        for gram in _grams(key, n):
+            posting = data.grams.get(gram)
+            if not posting:
+                postings = None
+                break
+            postings.append(posting)
+
+        best = {}
+        for position in (min(postings, key=len) if postings else []):
+            surface, entry_id, score = data.surfaces[position]
+            if key not in surface:
+                continue
+            if surface == key:
+                score = SCORE_EXACT
+            # Higher score, then prefix matches, then closest length, then oldest entry
+            rank = (-score, not surface.startswith(key), len(surface), entry_id)
+            current = best.get(entry_id)
+            if current is None or rank < current[1]:
+                best[entry_id] = (score, rank)
+
+        if not best and fuzzy:
+            best = self._fuzzy_candidates(data, key)
+
+        ranked = sorted(best.items(), key=lambda item: item[1][1])
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(entry_id, score) for entry_id, (score, rank) in ranked]
+
+    def segment(self, text):
+        """
+        Splits text into dictionary phrases using longest match from left to
+        right over the token trie. Returns (start, end, entry_id, score) spans
+        with offsets into text; numbers and units are never part of a span.
+        Unknown single words fall back to fuzzy matching.
+        """
+        if not text:
+            return []
+        data = self._get_data()
+        tokens = list(split_tokens(text))
+
+        spans = []
+        i = 0
+        while i < len(tokens):
+            start, end, key = tokens[i]
+            if is_quantity(key):
+                i += 1
+                continue
+
+            # Walk the trie as far as the tokens allow, remembering the last complete phrase
+            node = data.phrases
+            match = None
+            j = i
+            while j < len(tokens) and not is_quantity(tokens[j][2]):
+                node = node.get(tokens[j][2])
+                if node is None:
+                    break
+                j += 1
+                if _PHRASE_END in node:
+                    match = (j, node[_PHRASE_END])
+
+            if match:
+                match_end, entry_id = match
+                spans.append((start, tokens[match_end - 1][1], entry_id, SCORE_EXACT))
+                i = match_end
+                continue
+
+            if not any(char.isdigit() for char in key):
+                fuzzy = self._fuzzy_candidates(data, key)
+                if fuzzy:
+                    entry_id, (score, rank) = min(fuzzy.items(), key=lambda item: item[1][1])
+                    spans.append((start, end, entry_id, score))
+            i += 1
+        return spans
+
+    def complete(self, prefix, lang=None, limit=10):
+        """
+        Returns up to limit (entry_id, text, lang) completions of prefix, the
+        most used entries first (see usage_counts).
+        With lang, only translations in that language are completed;
+        otherwise every translation and alias is.
+        """
+        key = normalize_term(prefix)
+        if not key:
+            return []
+        data = self._get_data()
+        usage = self.usage_counts()
+
+        completions = data.completions
+        start = bisect.bisect_left(completions, (key,))
+        best = {}
+        for position in range(start, len(completions)):
+            surface, entry_id, surface_lang, text = completions[position]
+            if not surface.startswith(key):
+                break
+            if lang and surface_lang != lang:
+                continue
+            # Entries validated since the last read keep the count of the index build
+            usage_count = usage.get(entry_id, data.entries[entry_id][0])
+            rank = (-usage_count, len(surface), entry_id)
+            current = best.get(entry_id)
+            if current is None or rank < current[0]:
+                best[entry_id] = (rank, text, surface_lang)
+
+        top = heapq.nsmallest(limit, best.items(), key=lambda item: item[1][0])
+        return [(entry_id, text, surface_lang) for entry_id, (rank, text, surface_lang) in top]
+
+    def entry(self, entry_id):
+        """(usage count, category, translations) of a validated entry, from the index."""
+        return self._get_data().entries.get(entry_id)
+
+    def _fuzzy_candidates(self, data, key):
+        max_distance = _allowed_distance(key, data.max_distance)
+        if not max_distance:
+            return {}
+
+        deletes = data.get_deletes()
+        seen = set()
+        best = {}
+        for variant in _deletes(key[:FUZZY_PREFIX_LENGTH], max_distance):
+            for position in deletes.get(variant, ()):
+                if position in seen:
+                    continue
+                seen.add(position)
+
+                surface, entry_id, score = data.surfaces[position]
+                distance = edit_distance(key, surface, max_distance)
+                if distance > max_distance:
+                    continue
+                score = round(SCORE_FUZZY - SCORE_FUZZY_STEP * (distance - 1), 2)
+                rank = (-score, distance, abs(len(surface) - len(key)), entry_id)
+                current = best.get(entry_id)
+                if current is None or rank < current[1]:
+                    best[entry_id] = (score, rank)
+        return best
+
+    def _get_data(self):
+        self._sync()
+        data = self._data
+        if data is not None:
+            return data
+
+        with self._lock:
+            generation = self._generation
+            stamp_value = self._stamp_value
+
+        data = self._load_snapshot(stamp_value)
+        if data is None:
+            data = self._build()
+            self._save_snapshot(stamp_value, data)
+
+        with self._lock:
+            # Only publish if nobody invalidated the dictionary while we were building
+            if generation == self._generation:
+                self._data = data
+        return data
+
+    def _load_snapshot(self, stamp_value):
+        if not self.snapshot_dir or not stamp_value:
+            return None
+        state = read_snapshot(self.snapshot_dir, stamp_value)
+        if state is None:
+            return None
+        return _IndexData.from_state(state, self.max_distance)
+
+    def _save_snapshot(self, stamp_value, data):
+        # Never publish a version the current transaction may still roll back
+        if not self.snapshot_dir or not stamp_value or db.session.info.get('lexique_changed'):
+            return
+        try:
+            write_snapshot(self.snapshot_dir, stamp_value, data.to_state())
+        except OSError as e:
+            current_app.logger.warning(f"Could not write lexique snapshot: {e}")
+
+    def write_snapshot(self):
+        """Builds the index from the database and writes its snapshot. Returns the file path."""
+        if not self.snapshot_dir:
+            raise ValueError("LEXIQUE_SNAPSHOT_DIR n'est pas configuré")
+        self.stamp.expire()
+        if not self.stamp.current():
+            # Dictionary never changed since the version table was created
+            with db.engine.begin() as connection:
+                self.stamp.bump(connection)
+        self.invalidate()
+        self._sync()
+        return write_snapshot(self.snapshot_dir, self._stamp_value, self._build().to_state())
+
+    def _build(self):
+        rows = db.session.query(
+            LexiqueEntry.id, LexiqueEntry.translations, LexiqueEntry.aliases,
+            LexiqueEntry.usage_count, LexiqueEntry.category
+        ).filter(LexiqueEntry.is_validated == True).order_by(LexiqueEntry.id).all()
+
+        data = _IndexData(self.max_distance)
+        for entry_id, translations, aliases, usage_count, category in rows:
+            data.add_entry(entry_id, usage_count, category, translations or {})
+            for lang, translation in (translations or {}).items():
+                if translation:
+                    data.add_surface(translation, entry_id, SCORE_TRANSLATION, lang)
+            for alias in (aliases or []):
+                data.add_surface(alias, entry_id, SCORE_ALIAS)
+        data.completions.sort(key=lambda completion: completion[:2])
+        return data
+
+
+lexique_index = LexiqueIndex()
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_lexique_changes(session, flush_context):
+    if session.info.get('lexique_changed'):
+        return
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, LexiqueEntry):
+            session.info['lexique_changed'] = True
+            # Same transaction as the change: other workers see both or neither
+            lexique_index.stamp.bump(session.connection())
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('lexique_changed', False):
+        lexique_index.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_on_rollback(session):
+    # The index may have been built from the rolled back changes
+    if session.info.pop('lexique_changed', False):
+        lexique_index.invalidate()
@@ -1,6 +1,14 @@
+import copy
+import heapq
+from datetime import datetime
+from sqlalchemy import and_, func, insert, or_, select, update
+from config.settings import Config
 from models import db
 from models.lexique import LexiqueEntry, LexiqueSuggestion
 from flask_login import current_user
+from services.lexique_index import lexique_index, split_tokens
+from services.lexique_usage import usage_counter
+from utils.normalization import is_quantity, normalize_term
 
 class LexiqueService:
     @staticmethod
@@ -8,44 +16,267 @@ class LexiqueService:
         if not term:
             return None, 0.0
         
-        term_lower = term.lower().strip()
+        for entry_id, score in lexique_index.search(term, limit=1):
+            entry = db.session.get(LexiqueEntry, entry_id)
+            if entry:
+                usage_counter.record(entry.id)
+                return entry, score
         
-        entries = LexiqueEntry.query.filter_by(is_validated=True).all()
+        return None, 0.0
+    
+    @staticmethod
+    def search_entries(term, category=None):
+        ranked = lexique_index.search(term)
+        if not ranked:
+            return []
         
-        for entry in entries:
-            if entry.matches(term_lower):
-                entry.increment_usage()
-                db.session.commit()
-                return entry, 1.0
-        
-        for entry in entries:
-            translations = entry.translations or {}
-            for t_lang, translation in translations.items():
-                if translation and term_lower in translation.lower():
-                    entry.increment_usage()
-                    db.session.commit()
-                    return entry, 0.8
-            
-            for alias in (entry.aliases or []):
-                if term_lower in alias.lower():
-                    entry.increment_usage()
-                    db.session.commit()
-                    return entry, 0.7
+        ids = [entry_id for entry_id, score in ranked]
+        query = LexiqueEntry.query.filter(LexiqueEntry.id.in_(ids))
+        if category:
+            query = query.filter_by(category=category)
         
-        return None, 0.0
+        entries_by_id = {entry.id: entry for entry in query.all()}
+        return [entries_by_id[entry_id] for entry_id in ids if entry_id in entries_by_id]
+    
+    @staticmethod
+    def autocomplete(prefix, lang=None, limit=10):
+        """
+        Type-ahead completions of prefix, served from the in-memory index and
+        cached per dictionary version. Each result has the matched text, the
+        entry translation in lang (French when missing) and its category.
+        """
+        cache = lexique_index.translation_cache
+        # Rankings follow the usage counts: reading them first keeps usage_version current
+        lexique_index.usage_counts()
+        cache_key = (lexique_index.version, lexique_index.usage_version, 'complete', normalize_term(prefix), lang, limit)
+        results = cache.get(cache_key)
+        if results is None:
+            results = []
+            for entry_id, text, text_lang in lexique_index.complete(prefix, lang, limit):
+                usage_count, category, translations = lexique_index.entry(entry_id)
+                results.append({
+                    'id': entry_id,
+                    'text': text,
+                    'lang': text_lang,
+                    'translation': translations.get(lang or 'fr') or translations.get('fr'),
+                    'category': category
+                })
+            cache.set(cache_key, results)
+        return copy.deepcopy(results)
+    
+    @staticmethod
+    def browse_entries(search=None, category=None, after=None, per_page=50,
+                       max_results=1000, count_limit=1000):
+        """
+        One page of validated entries, most used first, for the dictionary
+        browser. Pages are walked with keyset pagination on (usage_count, id):
+        `after` is the `next_cursor` of the previous page. A search keeps the
+        max_results most used index matches (in category), the first ones of
+        the list, so that the pages only miss its tail.
+        Returns a dict with entries, next_cursor (None on the last page) and
+        total, counted up to count_limit only. total_is_estimate is True when
+        total is a lower bound (more than count_limit or max_results matches).
+        """
+        query = LexiqueEntry.query.filter(LexiqueEntry.is_validated == True)
+        if category:
+            query = query.filter(LexiqueEntry.category == category)
+        truncated = False
+        if search:
+            ids = [entry_id for entry_id, score in lexique_index.search(search)]
+            if category:
+                ids = [entry_id for entry_id in ids if lexique_index.entry(entry_id)[1] == category]
+            if len(ids) > max_results:
+                usage = lexique_index.usage_counts()
+                ids = heapq.nsmallest(max_results, ids, key=lambda entry_id: (-usage.get(entry_id, 0), entry_id))
+                truncated = True
+            query = query.filter(LexiqueEntry.id.in_(ids))
+        
+        # Bounded count: exact for small results, "more than count_limit" otherwise
+        total = db.session.query(func.count()).select_from(
+            query.with_entities(LexiqueEntry.id).limit(count_limit + 1).subquery()
+        ).scalar()
+        
+        cursor = LexiqueService._parse_cursor(after)
+        if cursor:
+            usage_count, entry_id = cursor
+            query = query.filter(or_(
+                LexiqueEntry.usage_count < usage_count,
+                and_(LexiqueEntry.usage_count == usage_count, LexiqueEntry.id > entry_id)
+            ))
+        
+        entries = query.order_by(
+            LexiqueEntry.usage_count.desc(), LexiqueEntry.id
+        ).limit(per_page + 1).all()
+        
+        next_cursor = None
+        if len(entries) > per_page:
+            entries = entries[:per_page]
+            last = entries[-1]
+            next_cursor = f'{last.usage_count or 0}.{last.id}'
+        
+        return {
+            'entries': entries,
+            'next_cursor': next_cursor,
+            'total': min(total, count_limit),
+            'total_is_estimate': truncated or total > count_limit
+        }
+    
+    @staticmethod
+    def _parse_cursor(after):
+        try:
+            usage_count, entry_id = after.split('.')
+            return int(usage_count), int(entry_id)
+        except (AttributeError, ValueError):
+            return None
     
     @staticmethod
     def translate(term, from_lang=None, to_lang='fr'):
-        entry, score = LexiqueService.search(term)
+        return LexiqueService.translate_many([term], from_lang, to_lang)[0]
+    
+    @staticmethod
+    def translate_many(terms, from_lang=None, to_lang='fr'):
+        """Translates a list of terms in one pass, results are in input order."""
+        cache = lexique_index.translation_cache
+        version = lexique_index.version
+        
+        # (entry_id, score, translation) per normalized term, from the cache when possible
+        resolved = {}
+        missing = {}
+        for term in terms:
+            key = normalize_term(term)
+            if key in resolved or key in missing:
+                continue
+            cached = cache.get((version, 'term', key, to_lang))
+            if cached is not None:
+                resolved[key] = cached
+            elif key:
+                ranked = lexique_index.search(key, limit=1)
+                missing[key] = ranked[0] if ranked else (None, 0.0)
+            else:
+                resolved[key] = (None, 0.0, None)
+        
+        entry_ids = {entry_id for entry_id, score in missing.values() if entry_id is not None}
+        entries = {}
+        if entry_ids:
+            entries = {
+                entry.id: entry
+                for entry in LexiqueEntry.query.filter(LexiqueEntry.id.in_(entry_ids)).all()
+            }
+        for key, (entry_id, score) in missing.items():
+            entry = entries.get(entry_id)
+            if entry:
+                resolved[key] = (entry.id, score, entry.get_translation(to_lang))
+            else:
+                resolved[key] = (None, 0.0, None)
+            cache.set((version, 'term', key, to_lang), resolved[key])
         
-        if entry:
-            translation = entry.get_translation(to_lang)
+        results = []
+        hits = {}
+        for term in terms:
+            entry_id, score, translation = resolved[normalize_term(term)]
+            if entry_id is not None:
+                hits[entry_id] = hits.get(entry_id, 0) + 1
+            results.append(LexiqueService._translation_result(term, entry_id, score, translation))
+        
+        if hits:
+            usage_counter.record_many(hits)
+        
+        return results
+    
+    @staticmethod
+    def translate_line(description, from_lang=None, to_lang='fr'):
+        """
+        Translates an order line phrase by phrase. Numbers, units and unknown
+        words are kept as typed; the snapshot lists every translated span.
+        """
+        cache = lexique_index.translation_cache
+        key = (lexique_index.version, 'line', description, to_lang)
+        
+        result = cache.get(key)
+        if result is None:
+            result = LexiqueService._translate_line(description, to_lang)
+            cache.set(key, result)
+        
+        hits = {}
+        for span in result['spans']:
+            hits[span['entry_id']] = hits.get(span['entry_id'], 0) + 1
+        if not result['spans'] and result['entry_id'] is not None:
+            hits[result['entry_id']] = 1
+        if hits:
+            usage_counter.record_many(hits)
+        
+        return copy.deepcopy(result)
+    
+    @staticmethod
+    def _translate_line(description, to_lang):
+        spans = lexique_index.segment(description)
+        if not spans:
+            resolved = (None, 0.0, None)
+            for entry_id, score in lexique_index.search(description, limit=1):
+                entry = db.session.get(LexiqueEntry, entry_id)
+                if entry:
+                    resolved = (entry.id, score, entry.get_translation(to_lang))
+            result = LexiqueService._translation_result(description, *resolved)
+            result['spans'] = []
+            return result
+        
+        entry_ids = {entry_id for start, end, entry_id, score in spans}
+        entries = {
+            entry.id: entry
+            for entry in LexiqueEntry.query.filter(LexiqueEntry.id.in_(entry_ids)).all()
+        }
+        
+        parts = []
+        span_results = []
+        matched_words = 0.0
+        position = 0
+        for start, end, entry_id, score in spans:
+            entry = entries.get(entry_id)
+            translation = entry.get_translation(to_lang) if entry else None
+            if not translation:
+                continue
+            
+            words = sum(1 for token in split_tokens(description[start:end]))
+            matched_words += words * score
+            
+            parts.append(description[position:start])
+            parts.append(translation)
+            position = end
+            span_results.append({
+                'original': description[start:end],
+                'translation': translation,
+                'confidence': score,
+                'entry_id': entry_id,
+                'start': start,
+                'end': end
+            })
+        parts.append(description[position:])
+        
+        # Confidence is the share of translatable words covered, weighted by span confidence
+        total_words = sum(
+            1 for start, end, key in split_tokens(description) if not is_quantity(key)
+        )
+        confidence = round(matched_words / total_words, 2) if total_words else 0.0
+        whole = len(span_results) == 1 and confidence == span_results[0]['confidence']
+        
+        return {
+            'original': description,
+            'translation': ''.join(parts),
+            'confidence': confidence,
+            'source': 'dictionary' if whole else ('phrase' if span_results else 'unknown'),
+            'entry_id': span_results[0]['entry_id'] if whole else None,
+            'spans': span_results
+        }
+    
+    @staticmethod
+    def _translation_result(term, entry_id, score, translation):
+        if entry_id is not None:
             return {
                 'original': term,
                 'translation': translation,
                 'confidence': score,
                 'source': 'dictionary',
-                'entry_id': entry.id
+                'entry_id': entry_id
             }
         
         return {
@@ -65,6 +296,20 @@ class LexiqueService:
     
     @staticmethod
     def suggest_term(original_term, suggested_translations, category=None, context=None, source_language=None):
+        if lexique_index.lookup(original_term) is not None:
+            raise ValueError("Ce terme existe déjà dans le dictionnaire")
+        
+        # Suggesting a term already waiting for review completes that suggestion
+        suggestion = LexiqueSuggestion.query.filter_by(
+            status='pending', normalized_term=normalize_term(original_term)
+        ).order_by(LexiqueSuggestion.id).first()
+        if suggestion:
+            pending = {'suggested_translations': dict(suggestion.suggested_translations or {})}
+            if LexiqueService._merge_translations(pending, suggested_translations):
+                suggestion.suggested_translations = pending['suggested_translations']
+                db.session.commit()
+            return suggestion
+        
         suggestion = LexiqueSuggestion(
             suggested_by_id=current_user.id,
             company_id=current_user.company_id,
@@ -81,6 +326,151 @@ class LexiqueService:
         
         return suggestion
     
+    @staticmethod
+    def _pending_suggestions():
+        """Pending suggestions keyed by normalized original term, loaded with one query."""
+        rows = db.session.query(
+            LexiqueSuggestion.id, LexiqueSuggestion.original_term, LexiqueSuggestion.suggested_translations
+        ).filter(LexiqueSuggestion.status == 'pending').order_by(LexiqueSuggestion.id)
+        
+        pending = {}
+        for suggestion_id, term, translations in rows:
+            pending.setdefault(normalize_term(term), {
+                'id': suggestion_id,
+                'suggested_translations': dict(translations or {})
+            })
+        return pending
+    
+    @staticmethod
+    def backfill_normalized_terms(batch_size=500):
+        """
+        Fills normalized_term of the suggestions written before the column
+        existed, batch_size rows per UPDATE and commit. Returns the number of
+        suggestions updated.
+        """
+        updated = 0
+        while True:
+            rows = db.session.execute(
+                select(LexiqueSuggestion.id, LexiqueSuggestion.original_term)
+                .where(LexiqueSuggestion.normalized_term.is_(None))
+                .order_by(LexiqueSuggestion.id).limit(batch_size)
+            ).all()
+            if not rows:
+                return updated
+            db.session.execute(update(LexiqueSuggestion), [
+                {'id': suggestion_id, 'normalized_term': normalize_term(term)}
+                for suggestion_id, term in rows
+            ])
+            db.session.commit()
+            updated += len(rows)
+    
+    @staticmethod
+    def _merge_translations(target, translations):
+        # Translations already suggested win, only missing languages are added
+        current = target['suggested_translations']
+        added = {lang: value for lang, value in translations.items() if value and lang not in current}
+        if added:
+            target['suggested_translations'] = {**current, **added}
+        return bool(added)
+    
+    @staticmethod
+    def import_suggestions(rows, context="Import en masse", chunk_size=500):
+        """
+        Queues imported terms for validation. rows yields (line_number, row)
+        as produced by utils.tabular.iter_rows; suggestions are inserted with
+        one multi-row INSERT and one commit per chunk_size rows.
+        Terms already in the dictionary are skipped as duplicates, terms
+        already pending (in the database or earlier in the file) are merged
+        into that suggestion.
+        Returns counters per status (created, skipped, duplicate, invalid)
+        and the detail of every row that was not created.
+        """
+        report = {'created': 0, 'skipped': 0, 'duplicate': 0, 'invalid': 0, 'rows': []}
+        pending = LexiqueService._pending_suggestions()
+        chunk = []
+        # suggestion id -> translations, for pending suggestions completed by the file
+        merged = {}
+        
+        def reject(line, status, term, reason):
+            report[status] += 1
+            report['rows'].append({'line': line, 'status': status, 'term': term, 'reason': reason})
+        
+        def flush():
+            if chunk:
+                ids = db.session.scalars(
+                    insert(LexiqueSuggestion).returning(LexiqueSuggestion.id, sort_by_parameter_order=True),
+                    chunk
+                ).all()
+                for mapping, suggestion_id in zip(chunk, ids):
+                    mapping['id'] = suggestion_id
+                report['created'] += len(chunk)
+                chunk.clear()
+            if merged:
+                db.session.execute(update(LexiqueSuggestion), [
+                    {'id': suggestion_id, 'suggested_translations': translations}
+                    for suggestion_id, translations in merged.items()
+                ])
+                merged.clear()
+            db.session.commit()
+        
+        max_term = LexiqueSuggestion.original_term.type.length
+        max_category = LexiqueSuggestion.category.type.length
+        
+        for line, row in rows:
+            # Expected columns: fr, en, ar, dr, category
+            translations = {
+                lang: row[lang] for lang in Config.SUPPORTED_LANGUAGES if row.get(lang)
+            }
+            category = row.get('category') or 'general'
+            
+            if not translations and not row.get('category'):
+                reject(line, 'skipped', '', "Ligne vide")
+                continue
+            
+            term = translations.get('fr', '')
+            if not term:
+                reject(line, 'invalid', '', "Terme français manquant")
+                continue
+            if len(term) > max_term:
+                reject(line, 'invalid', term, "Terme trop long")
+                continue
+            if len(category) > max_category:
+                reject(line, 'invalid', term, "Catégorie trop longue")
+                continue
+            
+            if lexique_index.lookup(term) is not None:
+                reject(line, 'duplicate', term, "Terme déjà présent dans le dictionnaire")
+                continue
+            
+            key = normalize_term(term)
+            existing = pending.get(key)
+            if existing:
+                if LexiqueService._merge_translations(existing, translations) and 'id' in existing:
+                    # Rows still in the chunk are inserted with the merged translations
+                    merged[existing['id']] = existing['suggested_translations']
+                reject(line, 'duplicate', term, "Fusionné avec une suggestion en attente")
+                continue
+            
+            mapping = {
+                'suggested_by_id': current_user.id,
+                'company_id': current_user.company_id,
+                'original_term': term,
+                # Bulk inserts skip the ORM events that fill normalized_term
+                'normalized_term': key,
+                'source_language': 'fr',
+                'suggested_translations': translations,
+                'category': category,
+                'context': context,
+                'status': 'pending',
+            }
+            pending[key] = mapping
+            chunk.append(mapping)
+            if len(chunk) >= chunk_size:
+                flush()
+        
+        flush()
+        return report
+    
     @staticmethod
     def get_pending_suggestions():
         return LexiqueSuggestion.query.filter_by(status='pending').order_by(
@@ -88,52 +478,93 @@ class LexiqueService:
         ).all()
     
     @staticmethod
-    def approve_suggestion(suggestion_id, translations=None, category=None):
-        suggestion = LexiqueSuggestion.query.get(suggestion_id)
-        if not suggestion:
-            raise ValueError("Suggestion non trouvée")
-        
-        final_translations = translations or suggestion.suggested_translations
-        final_category = category or suggestion.category or 'general'
-        
+    def _approve(suggestion, reviewer_id, reviewed_at, translations=None, category=None):
+        # Linked through the relationship: the foreign key is filled in when
+        # the entry is inserted, by the same flush as every other approval
         entry = LexiqueEntry(
-            category=final_category,
-            translations=final_translations,
+            category=category or suggestion.category or 'general',
+            translations=translations or suggestion.suggested_translations,
             aliases=[suggestion.original_term],
             is_validated=True,
             usage_count=0
         )
-        
-        db.session.add(entry)
-        
+        suggestion.lexique_entry = entry
         suggestion.status = 'approved'
-        suggestion.reviewed_by_id = current_user.id
-        suggestion.lexique_entry_id = entry.id
-        
-        from datetime import datetime
-        suggestion.reviewed_at = datetime.utcnow()
+        suggestion.reviewed_by_id = reviewer_id
+        suggestion.reviewed_at = reviewed_at
+        db.session.add(entry)
+        return entry
+    
+    @staticmethod
+    def approve_suggestion(suggestion_id, translations=None, category=None):
+        suggestion = db.session.get(LexiqueSuggestion, suggestion_id)
+        if not suggestion:
+            raise ValueError("Suggestion non trouvée")
         
+        entry = LexiqueService._approve(suggestion, current_user.id, datetime.utcnow(), translations, category)
         db.session.commit()
         
         return entry
     
     @staticmethod
     def reject_suggestion(suggestion_id, notes=None):
-        suggestion = LexiqueSuggestion.query.get(suggestion_id)
+        suggestion = db.session.get(LexiqueSuggestion, suggestion_id)
         if not suggestion:
             raise ValueError("Suggestion non trouvée")
         
         suggestion.status = 'rejected'
         suggestion.reviewed_by_id = current_user.id
         suggestion.review_notes = notes
-        
-        from datetime import datetime
         suggestion.reviewed_at = datetime.utcnow()
         
         db.session.commit()
         
         return suggestion
     
+    @staticmethod
+    def approve_many(suggestion_ids=None, category=None):
+        """
+        Approves the selected pending suggestions (every pending one when
+        suggestion_ids is None), optionally restricted to a category, with
+        their suggested translations. Runs in a single transaction with one
+        flush: the dictionary index is invalidated, and later rebuilt, once.
+        """
+        query = LexiqueSuggestion.query.filter(LexiqueSuggestion.status == 'pending')
+        if suggestion_ids is not None:
+            query = query.filter(LexiqueSuggestion.id.in_(suggestion_ids))
+        if category:
+            query = query.filter(LexiqueSuggestion.category == category)
+        
+        # Read before touching any suggestion: reloading the user would autoflush mid-batch
+        reviewer_id = current_user.id
+        reviewed_at = datetime.utcnow()
+        entries = [
+            LexiqueService._approve(suggestion, reviewer_id, reviewed_at)
+            for suggestion in query.order_by(LexiqueSuggestion.id).all()
+        ]
+        db.session.commit()
+        
+        return entries
+    
+    @staticmethod
+    def reject_many(suggestion_ids=None, category=None, notes=None):
+        """Rejects the selected pending suggestions with one UPDATE. Returns how many were rejected."""
+        stmt = update(LexiqueSuggestion).where(LexiqueSuggestion.status == 'pending')
+        if suggestion_ids is not None:
+            stmt = stmt.where(LexiqueSuggestion.id.in_(suggestion_ids))
+        if category:
+            stmt = stmt.where(LexiqueSuggestion.category == category)
+        
+        result = db.session.execute(stmt.values(
+            status='rejected',
+            reviewed_by_id=current_user.id,
+            review_notes=notes,
+            reviewed_at=datetime.utcnow()
+        ).execution_options(synchronize_session='fetch'))
+        db.session.commit()
+        
+        return result.rowcount
+    
     @staticmethod
     def add_entry(translations, category='general', aliases=None):
         entry = LexiqueEntry(
@@ -0,0 +1,94 @@
+# /* * Nom de l'application : BTP Commande
+#  * Description : Instantanés binaires de l'index du dictionnaire
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+
+import glob
+import marshal
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+MAGIC = b'BTPLEX'
+FORMAT_VERSION = 4
+
+# magic, format version, interpreter tag, dictionary version, payload length
+_HEADER = struct.Struct('<6sH16sQQ')
+# marshal data is only readable by the interpreter version that wrote it
+_INTERPRETER = sys.implementation.cache_tag.encode()[:16]
+
+
+def snapshot_path(directory, version):
+    return os.path.join(directory, f'lexique-{version}.snap')
+
+
+def write_snapshot(directory, version, state):
+    """
+    Atomically writes state (built from marshal-friendly dicts, lists and
+    tuples) as the snapshot of dictionary version, then removes snapshots
+    of older versions. Returns the path of the file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    payload = marshal.dumps(state)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, _INTERPRETER, version, len(payload))
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        path = snapshot_path(directory, version)
+        # Readers only ever see a complete file
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    for other in glob.glob(os.path.join(directory, 'lexique-*.snap')):
+        if other != path:
+            try:
+                os.unlink(other)
+            except OSError:
+                pass
+    return path
+
+
+def read_snapshot(directory, version):
+    """
+    Returns the state stored for dictionary version, or None when there is
+    no usable snapshot (missing, other version, other interpreter, truncated).
+    The file is memory-mapped and decoded straight from the page cache, but
+    marshal builds the index objects in the heap of each worker: the
+    snapshot saves the database queries and the build, not the memory.
+    """
+    try:
+        f = open(snapshot_path(directory, version), 'rb')
+    except OSError:
+        return None
+
+    with f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+        with mapped:
+            if len(mapped) < _HEADER.size:
+                return None
+            magic, format_version, interpreter, stored_version, length = _HEADER.unpack_from(mapped)
+            if (magic != MAGIC or format_version != FORMAT_VERSION or
+                    interpreter.rstrip(b'\0') != _INTERPRETER or stored_version != version or
+                    len(mapped) != _HEADER.size + length):
+                return None
+            with memoryview(mapped) as view:
+                try:
+                    return marshal.loads(view[_HEADER.size:])
+                except (EOFError, ValueError, TypeError):
+                    return None
@@ -0,0 +1,153 @@
+# /* * Nom de l'application : BTP Commande
+#  * Description : Compteurs d'utilisation du dictionnaire (écriture différée)
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+
+import atexit
+import threading
+import time
+from flask import current_app
+from sqlalchemy import bindparam, func, update
+from models import db
+from models.lexique import LexiqueEntry
+from services.lexique_index import lexique_index
+
+
+class LexiqueUsageCounter:
+    """
+    Buffers dictionary hits in memory so that lookups stay read-only.
+    Pending hits are written with one UPDATE per entry, either once
+    `flush_threshold` hits are pending or at most `flush_interval` seconds
+    after they were recorded: a daemon timer flushes the buffer of a worker
+    that receives no further hits.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_hits = 0
+        self._last_flush = time.monotonic()
+        self._app = None
+        self._timer = None
+        self.flush_threshold = 50
+        self.flush_interval = 30
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.flush_threshold = app.config.get('LEXIQUE_USAGE_FLUSH_THRESHOLD', self.flush_threshold)
+        self.flush_interval = app.config.get('LEXIQUE_USAGE_FLUSH_INTERVAL', self.flush_interval)
+
+        with self._lock:
+            # Hits still pending belong to the previous application's database
+            self._pending = {}
+            self._pending_hits = 0
+            self._last_flush = time.monotonic()
+            self._cancel_timer()
+            if self._app is None:
+                atexit.register(self._flush_at_exit)
+            self._app = app
+
+    def record(self, entry_id, count=1):
+        self.record_many({entry_id: count})
+
+    def record_many(self, counts):
+        """Records several hits at once, counts maps entry id -> number of hits."""
+        with self._lock:
+            for entry_id, count in counts.items():
+                self._pending[entry_id] = self._pending.get(entry_id, 0) + count
+                self._pending_hits += count
+            due = (self._pending_hits >= self.flush_threshold or
+                   time.monotonic() - self._last_flush >= self.flush_interval)
+            if not due:
+                self._start_timer()
+
+        if due:
+            try:
+                self.flush()
+            except Exception as e:
+                # Hits were put back in the buffer, the lookup itself must not fail
+                current_app.logger.warning(f"Lexique usage flush failed: {e}")
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Writes pending hits to the database. Must run inside an app context."""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._pending_hits = 0
+            self._last_flush = time.monotonic()
+            self._cancel_timer()
+
+        if not pending:
+            return 0
+
+        table = LexiqueEntry.__table__
+        stmt = update(table).where(
+            table.c.id == bindparam('entry_id')
+        ).values(
+            usage_count=func.coalesce(table.c.usage_count, 0) + bindparam('hits')
+        )
+
+        try:
+            # Dedicated connection: the caller's session is never written to
+            with db.engine.begin() as conn:
+                conn.execute(stmt, [
+                    {'entry_id': entry_id, 'hits': hits}
+                    for entry_id, hits in pending.items()
+                ])
+        except Exception:
+            with self._lock:
+                for entry_id, hits in pending.items():
+                    self._pending[entry_id] = self._pending.get(entry_id, 0) + hits
+                    self._pending_hits += hits
+            raise
+
+        # The rankings pick up the new counts on their next use
+        lexique_index.expire_usage()
+        return len(pending)
+
+    def _start_timer(self):
+        # Called with the lock held
+        if self._timer is None and self._app is not None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _cancel_timer(self):
+        # Called with the lock held
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+            app = self._app
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception as e:
+            app.logger.warning(f"Lexique usage flush failed: {e}")
+            # Hits were put back in the buffer: try again later
+            with self._lock:
+                if self._pending and self._app is app:
+                    self._start_timer()
+
+    def _flush_at_exit(self):
+        if self._app is None:
+            return
+        try:
+            with self._app.app_context():
+                self.flush()
+        except Exception as e:
+            # Outside the app context, which may be the one that failed to set up
+            self._app.logger.warning(f"Could not flush lexique usage counters: {e}")
+
+
+usage_counter = LexiqueUsageCounter()
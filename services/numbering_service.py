@@ -0,0 +1,122 @@
+# /* * Nom de l'application : BTP Commande
+#  * Description : Attribution atomique des numéros de bons de commande
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+
+from datetime import datetime
+from sqlalchemy import case, exists, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db
+from models.bc_sequence import BcSequence
+
+# Numbering settings used when the company has not configured its own
+DEFAULT_NUMBERING = {
+    'prefix': 'BC',
+    'separator': '-',
+    'year_format': 'YYYY',
+    'sequence_length': 3,
+    'start_number': 1,
+}
+
+
+class NumberingService:
+    """
+    Purchase order numbers come from the bc_sequences table, one row per
+    company and year. A reservation is a single UPDATE ... RETURNING that
+    increments the row: the row lock (PostgreSQL) or the database write
+    lock (SQLite) is held until the caller's transaction ends, so two
+    concurrent orders can never get the same number, and a rolled back
+    order gives its number back.
+    """
+
+    @staticmethod
+    def get_settings(company):
+        numbering = dict(DEFAULT_NUMBERING)
+        if company.settings and 'numbering' in company.settings:
+            numbering.update(company.settings['numbering'])
+        numbering['sequence_length'] = int(numbering['sequence_length'])
+        numbering['start_number'] = int(numbering['start_number'])
+        return numbering
+
+    @staticmethod
+    def allocate(company, count=1, now=None):
+        """
+        Reserves count consecutive purchase order numbers for company, in
+        the current transaction, and returns them formatted. Bulk creations
+        reserve all their numbers with one statement.
+        """
+        numbering = NumberingService.get_settings(company)
+        now = now or datetime.utcnow()
+
+        first = NumberingService.reserve(company, now.year, count, numbering['start_number'])
+
+        # Any year_format other than 'YYYY' is formatted as YY
+        year = str(now.year) if numbering['year_format'] == 'YYYY' else str(now.year)[2:]
+        prefix = numbering['separator'].join([numbering['prefix'], year])
+        return [
+            numbering['separator'].join([prefix, str(number).zfill(numbering['sequence_length'])])
+            for number in range(first, first + count)
+        ]
+
+    @staticmethod
+    def reserve(company, year, count=1, start_number=1):
+        """Atomically reserves count consecutive numbers of (company, year), returns the first one."""
+        table = BcSequence.__table__
+        floor = start_number - 1
+        dialect = db.session.get_bind().dialect
+
+        # On SQLite the driver opens the transaction lazily, at its first write:
+        # this UPDATE takes the database write lock up front, like BEGIN IMMEDIATE,
+        # and concurrent writers wait for it (busy timeout) instead of deadlocking
+        while True:
+            # Jumps to start_number when it was raised above the current counter
+            statement = update(table).where(
+                table.c.company_id == company.id, table.c.year == year
+            ).values(
+                last_value=case((table.c.last_value < floor, floor), else_=table.c.last_value) + count,
+                updated_at=datetime.utcnow()
+            )
+            if dialect.update_returning:
+                last_value = db.session.execute(statement.returning(table.c.last_value)).scalar()
+            elif db.session.execute(statement).rowcount:
+                # The UPDATE already holds the write lock: this read cannot race
+                last_value = db.session.execute(
+                    select(table.c.last_value).where(table.c.company_id == company.id, table.c.year == year)
+                ).scalar()
+            else:
+                last_value = None
+            if last_value is not None:
+                return last_value - count + 1
+
+            last_value = max(floor, NumberingService._legacy_counter(company)) + count
+            if NumberingService._create_sequence(dialect, company.id, year, last_value):
+                return last_value - count + 1
+            # Created by a concurrent transaction in the meantime: increment it instead
+
+    @staticmethod
+    def _legacy_counter(company):
+        # The first sequence of a company continues Company.bc_counter, the counter
+        # used before bc_sequences, so that numbers already given are never reused
+        has_sequence = db.session.execute(
+            select(exists().where(BcSequence.company_id == company.id))
+        ).scalar()
+        return 0 if has_sequence else (company.bc_counter or 0)
+
+    @staticmethod
+    def _create_sequence(dialect, company_id, year, last_value):
+        values = {'company_id': company_id, 'year': year, 'last_value': last_value, 'updated_at': datetime.utcnow()}
+        if dialect.name == 'postgresql':
+            statement = postgresql.insert(BcSequence.__table__).values(**values).on_conflict_do_nothing()
+        elif dialect.name == 'sqlite':
+            statement = sqlite.insert(BcSequence.__table__).values(**values).on_conflict_do_nothing()
+        else:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(BcSequence.__table__).values(**values))
+            except IntegrityError:
+                return False
+            return True
+        return db.session.execute(statement).rowcount == 1
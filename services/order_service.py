@@ -1,8 +1,44 @@
+import base64
+import json
+from contextlib import contextmanager
 from datetime import datetime
+from decimal import Decimal
 from flask_login import current_user
+from sqlalchemy import and_, bindparam, func, or_, select, update
+from sqlalchemy.orm.attributes import set_committed_value
 from models import db
 from models.company import Company
 from models.order import Order, OrderLine, OrderHistory
+from services.numbering_service import NumberingService
+
+# Sort keys of the orders list: column, and how a cursor value is read back
+ORDER_SORT_KEYS = {
+    'date': (Order.created_at, datetime.fromisoformat),
+    'amount': (Order.total_ht, Decimal),
+    'reference': (Order.bc_number, str),
+}
+
+@contextmanager
+def unit_of_work():
+    """
+    One transaction for a whole workflow step: the order change, its
+    history row and the counters it updates are committed together, or
+    rolled back together if anything fails. Nested units join the
+    outermost one, which is the only one to commit.
+    """
+    session = db.session
+    depth = session.info.get('unit_of_work', 0)
+    session.info['unit_of_work'] = depth + 1
+    try:
+        yield session
+        if not depth:
+            session.commit()
+    except Exception:
+        if not depth:
+            session.rollback()
+        raise
+    finally:
+        session.info['unit_of_work'] = depth
 
 class OrderService:
     @staticmethod
@@ -13,130 +49,251 @@ class OrderService:
         if not company:
             raise ValueError("Société non trouvée")
         
-        # New Numbering Engine Logic
-        bc_number = OrderService.generate_reference(company)
-        
-        order = Order(
-            company_id=current_user.company_id,
-            project_id=project_id,
-            bc_number=bc_number,
-            status='BROUILLON',
-            requested_date=requested_date,
-            notes=notes,
-            notes_internal=notes_internal,
-            notes_supplier_fr=notes_supplier_fr,
-            notes_supplier_en=notes_supplier_en,
-            supplier_name=supplier_name,
-            supplier_contact=supplier_contact,
-            supplier_phone=supplier_phone,
-            created_by_id=current_user.id
-        )
+        with unit_of_work():
+            # The number is reserved in the same transaction: a failed creation gives it back
+            bc_number = OrderService.generate_reference(company)
+            
+            order = Order(
+                company_id=current_user.company_id,
+                project_id=project_id,
+                bc_number=bc_number,
+                status='BROUILLON',
+                requested_date=requested_date,
+                notes=notes,
+                notes_internal=notes_internal,
+                notes_supplier_fr=notes_supplier_fr,
+                notes_supplier_en=notes_supplier_en,
+                supplier_name=supplier_name,
+                supplier_contact=supplier_contact,
+                supplier_phone=supplier_phone,
+                created_by_id=current_user.id
+            )
+            
+            db.session.add(order)
+            # Assigns order.id for the history row
+            db.session.flush()
+            
+            OrderService.add_history(order, 'CREATION', None, 'BROUILLON', 
+                                     {'message': 'Création du bon de commande'})
         
-        db.session.add(order)
-        db.session.commit()
+        return order
+    
+    @staticmethod
+    def list_orders(query, sort='date', direction='desc', after=None, per_page=50):
+        """
+        One page of the orders of query (already filtered by tenant, status,
+        project...), sorted on sort (a key of ORDER_SORT_KEYS) then id.
+        Pages are walked with keyset pagination: `after` is the next_cursor
+        of the previous page, an opaque token only valid for the same sort.
+        Returns a dict with orders and next_cursor (None on the last page).
+        """
+        if sort not in ORDER_SORT_KEYS:
+            sort = 'date'
+        descending = direction != 'asc'
+        column, parse = ORDER_SORT_KEYS[sort]
         
-        OrderService.add_history(order, 'CREATION', None, 'BROUILLON', 
-                                 {'message': 'Création du bon de commande'})
+        cursor = OrderService._parse_cursor(after, sort, parse)
+        if cursor:
+            value, order_id = cursor
+            if descending:
+                query = query.filter(or_(column < value, and_(column == value, Order.id < order_id)))
+            else:
+                query = query.filter(or_(column > value, and_(column == value, Order.id > order_id)))
         
-        return order
+        if descending:
+            query = query.order_by(column.desc(), Order.id.desc())
+        else:
+            query = query.order_by(column, Order.id)
+        orders = query.limit(per_page + 1).all()
+        
+        next_cursor = None
+        if len(orders) > per_page:
+            orders = orders[:per_page]
+            last = orders[-1]
+            value = getattr(last, column.key)
+            value = value.isoformat() if sort == 'date' else str(value)
+            next_cursor = base64.urlsafe_b64encode(json.dumps([sort, value, last.id]).encode()).decode()
+        
+        return {'orders': orders, 'next_cursor': next_cursor}
+    
+    @staticmethod
+    def _parse_cursor(after, sort, parse):
+        try:
+            key, value, order_id = json.loads(base64.urlsafe_b64decode(after.encode()))
+            if key != sort:
+                return None
+            return parse(value), int(order_id)
+        except (AttributeError, TypeError, ValueError, ArithmeticError):
+            return None
+    
+    @staticmethod
+    def count_by_status(query):
+        """{status: number of orders} over query, in one grouped query."""
+        rows = query.order_by(None).with_entities(Order.status, func.count(Order.id)).group_by(Order.status)
+        return dict(rows.all())
     
     @staticmethod
     def generate_reference(company):
-        # Default fallback
-        prefix = 'BC'
-        separator = '-'
-        year_format = 'YYYY'
-        length = 3
-        start_number = 1
-
-        if company.settings and 'numbering' in company.settings:
-            n = company.settings['numbering']
-            prefix = n.get('prefix', 'BC')
-            separator = n.get('separator', '-')
-            year_format = n.get('year_format', 'YYYY')
-            length = int(n.get('sequence_length', 3))
-            start_number = int(n.get('start_number', 1))
-
-        # Manage counter
-        # We use bc_counter from company model as the persistent counter
-        # Check if we need to jump to start_number
-        if company.bc_counter < start_number - 1:
-            company.bc_counter = start_number - 1
-
-        company.bc_counter += 1
-        seq_num = company.bc_counter
-
-        now = datetime.utcnow()
-        year_str = str(now.year) if year_format == 'YYYY' else str(now.year)[2:]
-        seq_str = str(seq_num).zfill(length)
-
-        return f"{prefix}{separator}{year_str}{separator}{seq_str}"
+        # Atomic, per company and year (see NumberingService)
+        return NumberingService.allocate(company)[0]
 
     @staticmethod
     def add_line(order, description, quantity, unit='unite', unit_price=None, 
                  product_id=None, note=None, description_translated=None, translation_snapshot=None):
-        line_number = order.lines.count() + 1
-        
-        line = OrderLine(
-            order_id=order.id,
-            product_id=product_id,
-            line_number=line_number,
-            description=description,
-            description_translated=description_translated,
-            translation_snapshot=translation_snapshot,
-            quantity=quantity,
-            unit=unit,
-            unit_price=unit_price,
-            note=note
-        )
-        
-        db.session.add(line)
-        db.session.commit()
+        with unit_of_work():
+            # Numbered from the count returned by the locked order row: never twice the same number
+            line_number = OrderService._apply_line_change(
+                order, OrderLine.compute_subtotal(quantity, unit_price), 1
+            )
+            
+            line = OrderLine(
+                order_id=order.id,
+                product_id=product_id,
+                line_number=line_number,
+                description=description,
+                description_translated=description_translated,
+                translation_snapshot=translation_snapshot,
+                quantity=quantity,
+                unit=unit,
+                unit_price=unit_price,
+                note=note
+            )
+            db.session.add(line)
         
         return line
     
     @staticmethod
     def update_line(line, description=None, quantity=None, unit=None, unit_price=None, note=None):
-        if description is not None:
-            line.description = description
-        if quantity is not None:
-            line.quantity = quantity
-        if unit is not None:
-            line.unit = unit
-        if unit_price is not None:
-            line.unit_price = unit_price
-        if note is not None:
-            line.note = note
-        
-        db.session.commit()
+        with unit_of_work():
+            # Current values, locked (PostgreSQL) so that a concurrent edit of the line waits
+            db.session.refresh(line, with_for_update=True)
+            old_subtotal = line.get_subtotal()
+            if description is not None:
+                line.description = description
+            if quantity is not None:
+                line.quantity = quantity
+            if unit is not None:
+                line.unit = unit
+            if unit_price is not None:
+                line.unit_price = unit_price
+            if note is not None:
+                line.note = note
+            
+            OrderService._apply_line_change(line.order, line.get_subtotal() - old_subtotal, 0)
         return line
     
     @staticmethod
     def delete_line(line):
-        order = line.order
-        line_number = line.line_number
-        
-        db.session.delete(line)
-        
-        for remaining_line in order.lines.filter(OrderLine.line_number > line_number).all():
-            remaining_line.line_number -= 1
+        with unit_of_work():
+            db.session.refresh(line, with_for_update=True)
+            order = line.order
+            line_number = line.line_number
+            
+            # Locks the order row first: the renumbering cannot interleave with another line change
+            OrderService._apply_line_change(order, -line.get_subtotal(), -1)
+            db.session.delete(line)
+            db.session.execute(
+                update(OrderLine)
+                .where(OrderLine.order_id == order.id, OrderLine.line_number > line_number)
+                .values(line_number=OrderLine.line_number - 1)
+            )
+    
+    @staticmethod
+    def _apply_line_change(order, delta, count_delta):
+        """
+        Adds delta to the stored total of order and count_delta to its line
+        count with a single UPDATE, in the caller's transaction. The UPDATE
+        locks the order row until the transaction ends, so concurrent line
+        changes are applied one after the other instead of overwriting each
+        other. Returns the new line count.
+        """
+        orders = Order.__table__
+        statement = update(orders).where(orders.c.id == order.id).values(
+            total_ht=orders.c.total_ht + delta,
+            line_count=orders.c.line_count + count_delta
+        )
+        if db.session.get_bind().dialect.update_returning:
+            total_ht, line_count = db.session.execute(
+                statement.returning(orders.c.total_ht, orders.c.line_count)
+            ).one()
+        else:
+            db.session.execute(statement)
+            # The UPDATE already holds the row lock: this read cannot race
+            total_ht, line_count = db.session.execute(
+                select(orders.c.total_ht, orders.c.line_count).where(orders.c.id == order.id)
+            ).one()
         
-        db.session.commit()
+        # The instance now mirrors the row; total_ttc follows the new total, under the same lock
+        set_committed_value(order, 'total_ht', total_ht)
+        set_committed_value(order, 'line_count', line_count)
+        order.total_ttc = Order.compute_ttc(total_ht)
+        return line_count
+    
+    @staticmethod
+    def recompute_totals(company_id=None, missing_only=False, batch_size=500):
+        """
+        Recomputes line_count, total_ht and total_ttc of every order (of
+        company_id, or only those never computed with missing_only) from
+        their lines. Orders are processed batch_size at a time, each batch
+        costing two SELECTs, one batched UPDATE and one commit.
+        Returns the number of orders whose stored totals were wrong.
+        """
+        orders_table = Order.__table__
+        fixed = 0
+        last_id = 0
+        while True:
+            query = select(Order.id, Order.line_count, Order.total_ht, Order.total_ttc).where(Order.id > last_id)
+            if company_id is not None:
+                query = query.where(Order.company_id == company_id)
+            if missing_only:
+                query = query.where(Order.total_ht.is_(None))
+            orders = db.session.execute(query.order_by(Order.id).limit(batch_size)).all()
+            if not orders:
+                return fixed
+            last_id = orders[-1].id
+            
+            totals = {row.id: [0, Decimal('0')] for row in orders}
+            lines = db.session.execute(
+                select(OrderLine.order_id, OrderLine.quantity, OrderLine.unit_price)
+                .where(OrderLine.order_id.in_(list(totals)))
+            )
+            for order_id, quantity, unit_price in lines:
+                totals[order_id][0] += 1
+                totals[order_id][1] += OrderLine.compute_subtotal(quantity, unit_price)
+            
+            updates = []
+            for row in orders:
+                line_count, total_ht = totals[row.id]
+                total_ttc = Order.compute_ttc(total_ht)
+                if (row.line_count, row.total_ht, row.total_ttc) != (line_count, total_ht, total_ttc):
+                    updates.append({'order_id': row.id, 'line_count': line_count,
+                                    'total_ht': total_ht, 'total_ttc': total_ttc})
+            if updates:
+                # updated_at is set to itself: a recompute is not a change of the order
+                db.session.execute(
+                    orders_table.update().where(orders_table.c.id == bindparam('order_id')).values(
+                        line_count=bindparam('line_count'), total_ht=bindparam('total_ht'),
+                        total_ttc=bindparam('total_ttc'), updated_at=orders_table.c.updated_at
+                    ),
+                    updates
+                )
+                fixed += len(updates)
+            db.session.commit()
     
     @staticmethod
     def submit_order(order):
         if order.status != 'BROUILLON':
             raise ValueError("Seul un brouillon peut être soumis")
         
-        if order.lines.count() == 0:
+        if not order.line_count:
             raise ValueError("Le bon de commande doit contenir au moins une ligne")
         
-        old_status = order.status
-        order.status = 'SOUMIS'
-        db.session.commit()
-        
-        OrderService.add_history(order, 'SOUMISSION', old_status, 'SOUMIS',
-                                 {'message': 'Soumission pour validation'})
+        with unit_of_work():
+            old_status = order.status
+            order.status = 'SOUMIS'
+            
+            OrderService.add_history(order, 'SOUMISSION', old_status, 'SOUMIS',
+                                     {'message': 'Soumission pour validation'})
         
         return order
     
@@ -148,14 +305,14 @@ class OrderService:
         if not current_user.can_validate_orders():
             raise ValueError("Vous n'avez pas les droits pour valider")
         
-        old_status = order.status
-        order.status = 'VALIDE'
-        order.validated_by_id = current_user.id
-        order.validated_at = datetime.utcnow()
-        db.session.commit()
-        
-        OrderService.add_history(order, 'VALIDATION', old_status, 'VALIDE',
-                                 {'message': 'Validation du bon de commande'})
+        with unit_of_work():
+            old_status = order.status
+            order.status = 'VALIDE'
+            order.validated_by_id = current_user.id
+            order.validated_at = datetime.utcnow()
+            
+            OrderService.add_history(order, 'VALIDATION', old_status, 'VALIDE',
+                                     {'message': 'Validation du bon de commande'})
         
         return order
     
@@ -164,12 +321,12 @@ class OrderService:
         if order.status != 'SOUMIS':
             raise ValueError("Seul un BC soumis peut être rejeté")
         
-        old_status = order.status
-        order.status = 'BROUILLON'
-        db.session.commit()
-        
-        OrderService.add_history(order, 'REJET', old_status, 'BROUILLON',
-                                 {'message': 'Rejet du bon de commande', 'reason': reason})
+        with unit_of_work():
+            old_status = order.status
+            order.status = 'BROUILLON'
+            
+            OrderService.add_history(order, 'REJET', old_status, 'BROUILLON',
+                                     {'message': 'Rejet du bon de commande', 'reason': reason})
         
         return order
     
@@ -178,14 +335,14 @@ class OrderService:
         if order.status != 'VALIDE':
             raise ValueError("Seul un BC validé peut générer un PDF")
         
-        old_status = order.status
-        order.status = 'PDF_GENERE'
-        order.pdf_path = pdf_path
-        order.pdf_generated_at = datetime.utcnow()
-        db.session.commit()
-        
-        OrderService.add_history(order, 'PDF_GENERATION', old_status, 'PDF_GENERE',
-                                 {'message': 'Génération du PDF', 'pdf_path': pdf_path})
+        with unit_of_work():
+            old_status = order.status
+            order.status = 'PDF_GENERE'
+            order.pdf_path = pdf_path
+            order.pdf_generated_at = datetime.utcnow()
+            
+            OrderService.add_history(order, 'PDF_GENERATION', old_status, 'PDF_GENERE',
+                                     {'message': 'Génération du PDF', 'pdf_path': pdf_path})
         
         return order
     
@@ -194,19 +351,20 @@ class OrderService:
         if order.status not in ['VALIDE', 'PDF_GENERE', 'PARTAGE']:
             raise ValueError("Le BC doit être validé avant le partage")
         
-        old_status = order.status
-        order.status = 'PARTAGE'
-        order.shared_at = datetime.utcnow()
-        order.share_method = share_method
-        db.session.commit()
-        
-        OrderService.add_history(order, 'PARTAGE', old_status, 'PARTAGE',
-                                 {'message': f'Partage via {share_method}'})
+        with unit_of_work():
+            old_status = order.status
+            order.status = 'PARTAGE'
+            order.shared_at = datetime.utcnow()
+            order.share_method = share_method
+            
+            OrderService.add_history(order, 'PARTAGE', old_status, 'PARTAGE',
+                                     {'message': f'Partage via {share_method}'})
         
         return order
     
     @staticmethod
     def add_history(order, action, old_status, new_status, details=None):
+        # Committed with the change it records, by the caller's unit of work
         history = OrderHistory(
             order_id=order.id,
             user_id=current_user.id,
@@ -216,5 +374,4 @@ class OrderService:
             details=details
         )
         db.session.add(history)
-        db.session.commit()
         return history
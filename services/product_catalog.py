@@ -0,0 +1,117 @@
+# /* * Nom de l'application : BTP Commande
+#  * Description : Cache du catalogue d'articles par entreprise
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+
+import json
+import threading
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db
+from models.product import Product
+from utils.cache import LRUCache
+from services.version_stamp import VersionStamp
+
+
+class ProductCatalog:
+    """
+    Active products of each company, kept as the JSON document served to
+    the order edit page. Every company has its own version stamp
+    ('catalog:<company id>'), bumped in the transaction that changes one of
+    its products, so that every worker rebuilds only that company's catalog.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._stamps = {}
+        self.check_interval = 2.0
+        # company id -> (stamp value, payload bytes)
+        self._payloads = LRUCache(maxsize=256)
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.check_interval = app.config.get('CACHE_VERSION_CHECK_INTERVAL', self.check_interval)
+        self._payloads.configure(maxsize=app.config.get('PRODUCT_CATALOG_CACHE_SIZE', 256))
+        with self._lock:
+            # A new application means a new database: forget the previous versions
+            self._stamps.clear()
+
+    def stamp(self, company_id):
+        with self._lock:
+            stamp = self._stamps.get(company_id)
+            if stamp is None:
+                stamp = self._stamps[company_id] = VersionStamp(f'catalog:{company_id}', self.check_interval)
+            return stamp
+
+    def get(self, company_id):
+        """Returns (version, payload) where payload is the catalog as UTF-8 JSON."""
+        version = self.stamp(company_id).current()
+        cached = self._payloads.get(company_id)
+        if cached is not None and cached[0] == version:
+            return cached
+
+        cached = (version, self._build(company_id))
+        # Built from uncommitted product changes: serve it but do not keep it
+        if company_id not in db.session.info.get('catalog_changed', ()):
+            self._payloads.set(company_id, cached)
+        return cached
+
+    def invalidate(self, company_id):
+        self._payloads.pop(company_id)
+        self.stamp(company_id).expire()
+
+    def _build(self, company_id):
+        rows = db.session.execute(
+            select(Product.id, Product.reference, Product.labels, Product.unit, Product.unit_price)
+            .where(Product.company_id == company_id, Product.is_active.is_(True))
+            .order_by(Product.reference, Product.id)
+        ).all()
+        products = [
+            {
+                'id': product_id,
+                'reference': reference,
+                'labels': labels or {},
+                'unit': unit,
+                'unit_price': float(unit_price) if unit_price is not None else None
+            }
+            for product_id, reference, labels, unit, unit_price in rows
+        ]
+        return json.dumps({'products': products}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+product_catalog = ProductCatalog()
+
+
+def mark_catalog_changed(session, company_id):
+    """
+    Records that the session changed products of company_id, for bulk
+    statements that bypass the flush events. Bumps the company's stamp
+    once per transaction; the local copy is dropped on commit.
+    """
+    changed = session.info.setdefault('catalog_changed', set())
+    if company_id not in changed:
+        changed.add(company_id)
+        # Same transaction as the change: other workers see both or neither
+        product_catalog.stamp(company_id).bump(session.connection())
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_catalog_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Product):
+            mark_catalog_changed(session, obj.company_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    for company_id in session.info.pop('catalog_changed', ()):
+        product_catalog.invalidate(company_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_on_rollback(session):
+    for company_id in session.info.pop('catalog_changed', ()):
+        product_catalog.invalidate(company_id)
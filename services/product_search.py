@@ -0,0 +1,106 @@
+# /* * Nom de l'application : BTP Commande
+#  * Description : Recherche des articles par référence et libellé
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+
+import weakref
+from sqlalchemy import bindparam, inspect, text
+from models import db
+from models.product import Product, PRODUCTS_FTS_TABLE_DDL, PRODUCTS_FTS_TRIGGERS, PRODUCTS_FTS_TRIGGERS_DDL
+from utils.normalization import normalize_term
+
+# The trigram tokenizer cannot match fewer than 3 characters
+_FTS_MIN_LENGTH = 3
+
+# engine -> whether the products_fts table exists
+_fts_available = weakref.WeakKeyDictionary()
+
+
+class ProductSearch:
+    """
+    Substring search over Product.search_text (normalized reference and
+    labels in every language). PostgreSQL answers the LIKE from the pg_trgm
+    GIN index, SQLite from the products_fts FTS5 table.
+    """
+
+    @staticmethod
+    def filter(query, term):
+        """Restricts a Product query to the products matching term."""
+        key = normalize_term(term)
+        if not key:
+            return query.filter(db.false())
+
+        if len(key) >= _FTS_MIN_LENGTH and ProductSearch._fts_enabled():
+            phrase = '"' + key.replace('"', '""') + '"'
+            matches = text("SELECT rowid FROM products_fts WHERE products_fts MATCH :phrase").bindparams(phrase=phrase)
+            return query.filter(Product.id.in_(matches))
+
+        return query.filter(Product.search_text.contains(key, autoescape=True))
+
+    @staticmethod
+    def _fts_enabled():
+        engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            return False
+        available = _fts_available.get(engine)
+        if available is None:
+            # Through the session: a separate checkout would end its transaction on a shared connection
+            available = inspect(db.session.connection()).has_table('products_fts')
+            _fts_available[engine] = available
+        return available
+
+    @staticmethod
+    def install(connection):
+        """
+        Creates the search structures on an existing database and indexes
+        its products: the pg_trgm extension on PostgreSQL, the products_fts
+        table and its triggers on SQLite (the trigram index itself is
+        declared on the model). search_text is recomputed for every product
+        (rows written before the column existed, or by bulk statements).
+        Returns the number of products updated.
+        """
+        dialect = connection.dialect
+        fts = dialect.name == 'sqlite' and dialect.dbapi.sqlite_version_info >= (3, 34)
+        if dialect.name == 'postgresql':
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        if fts:
+            # The update trigger deletes the old search_text from the index: fired on
+            # rows that were never indexed, it corrupts products_fts. Triggers are
+            # dropped during the backfill and created again once the index is complete.
+            for name in PRODUCTS_FTS_TRIGGERS:
+                connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+
+        updated = ProductSearch._backfill(connection)
+
+        if fts:
+            connection.execute(text(PRODUCTS_FTS_TABLE_DDL))
+            connection.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+            for statement in PRODUCTS_FTS_TRIGGERS_DDL:
+                connection.execute(text(statement))
+        _fts_available.pop(connection.engine, None)
+        return updated
+
+    @staticmethod
+    def rebuild():
+        """Recomputes search_text and reindexes products_fts (see install). Returns the number of products updated."""
+        updated = ProductSearch.install(db.session.connection())
+        db.session.commit()
+        return updated
+
+    @staticmethod
+    def _backfill(connection):
+        table = Product.__table__
+        rows = connection.execute(db.select(table.c.id, table.c.reference, table.c.labels)).all()
+        updates = [
+            {'product_id': product_id, 'search_text': Product.build_search_text(reference, labels)}
+            for product_id, reference, labels in rows
+        ]
+        if updates:
+            # updated_at is set to itself so its onupdate does not fire for a reindex
+            statement = table.update().where(table.c.id == bindparam('product_id')).values(
+                search_text=bindparam('search_text'), updated_at=table.c.updated_at
+            )
+            connection.execute(statement, updates)
+        return len(updates)
@@ -0,0 +1,216 @@
+import csv
+import io
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from config.settings import Config
+from models import db
+from models.product import Product
+from services.product_catalog import mark_catalog_changed
+
+# Rows fetched per round trip by the CSV export
+EXPORT_BATCH_SIZE = 1000
+
+
+class ProductService:
+    @staticmethod
+    def catalog_columns():
+        """Columns of the catalog files, read by import_catalog and written by export_catalog."""
+        return ['reference', 'category', 'unit', 'unit_price'] + list(Config.SUPPORTED_LANGUAGES)
+
+    @staticmethod
+    def _parse_price(value):
+        price = Decimal(value.replace(' ', '').replace(',', '.'))
+        if not price.is_finite() or price < 0:
+            raise InvalidOperation(value)
+        return price.quantize(Decimal('0.01'))
+
+    @staticmethod
+    def import_catalog(rows, company_id, chunk_size=500):
+        """
+        Creates or updates the products of company_id from rows, as produced
+        by utils.tabular.iter_rows. Products are matched on their reference;
+        labels are given per language (fr, en, ar, dr columns) and merged
+        into the existing ones, empty cells leave the current value as is.
+        Rows repeating a reference are merged into a single product.
+        Each chunk of chunk_size rows costs one SELECT, one multi-row
+        INSERT ... ON CONFLICT (company_id, reference) DO UPDATE per set of
+        columns given by the file (usually one) and one commit: concurrent
+        imports of a reference update the same product. Products deactivated
+        by an admin stay inactive.
+        Returns counters per status (created, updated, skipped, invalid) and
+        the detail of every row that was not imported.
+        """
+        report = {'created': 0, 'updated': 0, 'skipped': 0, 'invalid': 0, 'rows': []}
+        # reference -> (first line, values) for the rows of the current chunk
+        chunk = {}
+
+        def reject(line, status, reference, reason):
+            report[status] += 1
+            report['rows'].append({'line': line, 'status': status, 'reference': reference, 'reason': reason})
+
+        def flush():
+            if not chunk:
+                return
+            existing = dict(db.session.execute(
+                select(Product.reference, Product.labels)
+                .where(Product.company_id == company_id, Product.reference.in_(list(chunk)))
+            ).all())
+
+            now = datetime.utcnow()
+            # Columns set by the rows -> rows: empty cells keep the current value
+            # (or the column default on insert), so each set gets its own upsert
+            groups = {}
+            for reference, (line, values) in chunk.items():
+                labels = values.pop('labels')
+                if reference not in existing and not labels.get('fr'):
+                    reject(line, 'invalid', reference, "Libellé français manquant")
+                    continue
+                labels = {**(existing.get(reference) or {}), **labels}
+                # Bulk statements skip the mapper events: search_text is computed here
+                groups.setdefault(tuple(sorted(values)), []).append({
+                    'company_id': company_id, 'reference': reference, 'labels': labels, 'is_active': True,
+                    'created_at': now, 'updated_at': now,
+                    'search_text': Product.build_search_text(reference, labels), **values
+                })
+                report['updated' if reference in existing else 'created'] += 1
+
+            for columns, products in groups.items():
+                statement = ProductService._upsert()
+                statement = statement.on_conflict_do_update(
+                    index_elements=[Product.company_id, Product.reference],
+                    set_={column: statement.excluded[column]
+                          for column in ('labels', 'search_text', 'updated_at') + columns}
+                )
+                db.session.execute(statement, products)
+            if groups:
+                mark_catalog_changed(db.session, company_id)
+            db.session.commit()
+            chunk.clear()
+
+        max_reference = Product.reference.type.length
+        max_category = Product.category.type.length
+        max_unit = Product.unit.type.length
+
+        for line, row in rows:
+            reference = row.get('reference', '')
+            labels = {lang: row[lang] for lang in Config.SUPPORTED_LANGUAGES if row.get(lang)}
+
+            if not any(row.values()):
+                reject(line, 'skipped', '', "Ligne vide")
+                continue
+            if not reference:
+                reject(line, 'invalid', '', "Référence manquante")
+                continue
+            if len(reference) > max_reference:
+                reject(line, 'invalid', reference, "Référence trop longue")
+                continue
+
+            values = {'labels': labels}
+            if row.get('category'):
+                if len(row['category']) > max_category:
+                    reject(line, 'invalid', reference, "Catégorie trop longue")
+                    continue
+                values['category'] = row['category']
+            if row.get('unit'):
+                if len(row['unit']) > max_unit:
+                    reject(line, 'invalid', reference, "Unité trop longue")
+                    continue
+                values['unit'] = row['unit']
+            if row.get('unit_price'):
+                try:
+                    values['unit_price'] = ProductService._parse_price(row['unit_price'])
+                except InvalidOperation:
+                    reject(line, 'invalid', reference, "Prix unitaire invalide")
+                    continue
+
+            if reference in chunk:
+                # Repeated in the file: later cells override earlier ones
+                first_line, previous = chunk[reference]
+                values['labels'] = {**previous['labels'], **labels}
+                chunk[reference] = (first_line, {**previous, **values})
+            else:
+                chunk[reference] = (line, values)
+            if len(chunk) >= chunk_size:
+                flush()
+
+        flush()
+        return report
+
+    @staticmethod
+    def _upsert():
+        # The application runs on PostgreSQL or SQLite, both have INSERT ... ON CONFLICT
+        if db.session.get_bind().dialect.name == 'postgresql':
+            return postgresql.insert(Product)
+        return sqlite.insert(Product)
+
+    @staticmethod
+    def reference_taken(company_id, reference, product_id=None):
+        """Whether another product of company_id already has reference."""
+        query = select(Product.id).where(Product.company_id == company_id, Product.reference == reference)
+        if product_id is not None:
+            query = query.where(Product.id != product_id)
+        return db.session.execute(query.limit(1)).first() is not None
+
+    @staticmethod
+    def deduplicate_references():
+        """
+        Prepares existing databases for the unique (company_id, reference)
+        index: empty references become NULL and, when several products
+        share a reference, the oldest one keeps it and the others get
+        "~<id>" appended, for an admin to rename or deactivate them.
+        Returns the number of products renamed.
+        """
+        db.session.execute(update(Product).where(Product.reference == '').values(reference=None))
+        first = (
+            select(Product.company_id, Product.reference, func.min(Product.id).label('first_id'))
+            .where(Product.reference.is_not(None))
+            .group_by(Product.company_id, Product.reference)
+            .having(func.count() > 1)
+            .subquery()
+        )
+        duplicates = db.session.execute(
+            select(Product.id, Product.reference)
+            .join(first, and_(Product.company_id == first.c.company_id, Product.reference == first.c.reference))
+            .where(Product.id != first.c.first_id)
+        ).all()
+        max_reference = Product.reference.type.length
+        if duplicates:
+            db.session.execute(update(Product), [
+                {'id': product_id, 'reference': reference[:max_reference - len(f'~{product_id}')] + f'~{product_id}'}
+                for product_id, reference in duplicates
+            ])
+        db.session.commit()
+        return len(duplicates)
+
+    @staticmethod
+    def export_catalog(company_id):
+        """
+        Yields the active products of company_id as CSV text, one line at a
+        time, in the format read by import_catalog. Rows are fetched
+        EXPORT_BATCH_SIZE at a time, the catalog is never held in memory.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def line(values):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(values)
+            return buffer.getvalue()
+
+        columns = ProductService.catalog_columns()
+        # BOM: lets Excel detect UTF-8 (Arabic labels)
+        yield '\ufeff' + line(columns)
+
+        result = db.session.execute(
+            select(Product.reference, Product.category, Product.unit, Product.unit_price, Product.labels)
+            .where(Product.company_id == company_id, Product.is_active.is_(True))
+            .order_by(Product.reference, Product.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        for reference, category, unit, unit_price, labels in result:
+            labels = labels or {}
+            yield line([reference or '', category, unit, '' if unit_price is None else unit_price] +
+                       [labels.get(lang, '') for lang in Config.SUPPORTED_LANGUAGES])
@@ -0,0 +1,81 @@
+# /* * Nom de l'application : BTP Commande
+#  * Description : Tampons de version partagés entre workers
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db
+from models.cache_version import CacheVersion
+
+
+class VersionStamp:
+    """
+    Version number stored in the cache_versions table and shared by every
+    gunicorn worker. A worker compares it with the version its local cache
+    was built from and rebuilds only when it changed. The table is read at
+    most once every `check_interval` seconds.
+    """
+
+    def __init__(self, name, check_interval=2.0):
+        self.name = name
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._value = None
+        self._checked_at = None
+
+    def init_app(self, app):
+        self.check_interval = app.config.get('CACHE_VERSION_CHECK_INTERVAL', self.check_interval)
+        self.expire()
+
+    def expire(self):
+        """Forces the next call to current() to read the database."""
+        with self._lock:
+            self._checked_at = None
+
+    def current(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self._value
+
+        value = db.session.execute(
+            select(CacheVersion.version).where(CacheVersion.name == self.name)
+        ).scalar()
+        value = value or 0
+
+        with self._lock:
+            self._value = value
+            self._checked_at = now
+        return value
+
+    def bump(self, connection):
+        """
+        Increments the shared version on connection, inside the caller's
+        transaction so that it is only visible once the change is committed.
+        """
+        table = CacheVersion.__table__
+        now = datetime.utcnow()
+        # Start from the clock so that a recreated database never reuses the
+        # versions of a previous one (files such as snapshots are named after them)
+        values = {'name': self.name, 'version': int(time.time()), 'updated_at': now}
+        dialect = connection.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            # One statement: two workers creating the row at the same time cannot
+            # fail the flush of an unrelated change with an IntegrityError
+            dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            connection.execute(dialect_insert(table).values(**values).on_conflict_do_update(
+                index_elements=[table.c.name], set_={'version': table.c.version + 1, 'updated_at': now}
+            ))
+            return
+
+        result = connection.execute(
+            update(table).where(table.c.name == self.name).values(version=table.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(**values))
@@ -8,3 +8,104 @@ function selectProduct(select) {
         }
     }
 }
+
+// Fills the product select from the company catalog. The response is cached
+// by the browser and revalidated (304) until a product changes.
+async function loadCatalog(select) {
+    const response = await fetch(select.dataset.catalogUrl);
+    if (!response.ok) {
+        return;
+    }
+    const data = await response.json();
+    const fragment = document.createDocumentFragment();
+    for (const product of data.products) {
+        const label = product.labels.fr || product.reference || '';
+        const option = document.createElement('option');
+        option.value = product.id;
+        option.textContent = label;
+        option.dataset.label = label;
+        option.dataset.unit = product.unit;
+        option.dataset.price = product.unit_price ?? '';
+        fragment.appendChild(option);
+    }
+    select.appendChild(fragment);
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const select = document.getElementById('product_id');
+    if (select && select.dataset.catalogUrl) {
+        loadCatalog(select);
+    }
+});
+
+// Type-ahead for the line description, filled from the dictionary.
+let completionTimer = null;
+function completeDescription(input, lang = '') {
+    clearTimeout(completionTimer);
+    const query = input.value.trim();
+    if (!query) {
+        return;
+    }
+    completionTimer = setTimeout(async () => {
+        const params = new URLSearchParams({ q: query, lang: lang });
+        const response = await fetch('/lexique/autocomplete?' + params.toString());
+        if (!response.ok) {
+            return;
+        }
+        const data = await response.json();
+        const list = document.getElementById(input.getAttribute('list'));
+        list.innerHTML = '';
+        for (const result of data.results) {
+            const option = document.createElement('option');
+            option.value = result.translation || result.text;
+            option.label = result.text;
+            list.appendChild(option);
+        }
+    }, 150);
+}
+
+// Infinite scrolling of the orders list: when the "Suivant" link comes into
+// view, the next page is appended to the table instead of being opened.
+function setupOrdersScroll(link) {
+    const rows = document.getElementById('orders-rows');
+    let loading = false;
+    const observer = new IntersectionObserver(async (entries) => {
+        if (!entries[0].isIntersecting || loading) {
+            return;
+        }
+        loading = true;
+        const response = await fetch(link.dataset.pageUrl, { headers: { 'Accept': 'application/json' } });
+        if (!response.ok) {
+            // Leave the link as a regular pagination link
+            observer.disconnect();
+            return;
+        }
+        const data = await response.json();
+        rows.insertAdjacentHTML('beforeend', data.html);
+        if (window.lucide) {
+            lucide.createIcons();
+        }
+        if (data.next_cursor) {
+            for (const attribute of ['href', 'data-page-url']) {
+                const url = new URL(link.getAttribute(attribute), window.location.origin);
+                url.searchParams.set('after', data.next_cursor);
+                link.setAttribute(attribute, url.pathname + url.search);
+            }
+            loading = false;
+            // Fires again if the link is still visible after the rows were added
+            observer.unobserve(link);
+            observer.observe(link);
+        } else {
+            observer.disconnect();
+            link.remove();
+        }
+    });
+    observer.observe(link);
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const link = document.getElementById('orders-next');
+    if (link && link.dataset.pageUrl) {
+        setupOrdersScroll(link);
+    }
+});
@@ -1,5 +1,8 @@
 import unittest
 import os
+import tempfile
+from contextlib import contextmanager
+from sqlalchemy import event
 
 # Set env vars BEFORE importing app/config so Config gets the right values
 os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
@@ -7,7 +10,9 @@ os.environ['SESSION_SECRET'] = 'test-secret'
 
 from models import db
 from app import create_app
+from config.settings import Config
 from models.company import Company
+from models.project import Project
 from models.user import User
 
 class BaseTestCase(unittest.TestCase):
@@ -46,3 +51,54 @@ class BaseTestCase(unittest.TestCase):
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
+
+    @contextmanager
+    def capture_statements(self):
+        """Collects the SQL statements sent to the database inside the block."""
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+
+class FileDatabaseTestCase(BaseTestCase):
+    """
+    Also runs a second application (file_app) on a temporary SQLite file,
+    with a company, a project and a user: concurrent sessions need a real
+    database file, :memory: is a single shared connection.
+    """
+
+    def setUp(self):
+        super().setUp()
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+
+        class FileConfig(Config):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{self.path}'
+            SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
+
+        self.file_app = create_app(FileConfig)
+        with self.file_app.app_context():
+            db.create_all()
+            company = Company(name="Concurrent Company", ice="111111111")
+            db.session.add(company)
+            db.session.flush()
+            project = Project(name="Chantier", company_id=company.id)
+            user = User(email="buyer@test.com", first_name="Buyer", last_name="User", company_id=company.id)
+            user.set_password("password")
+            db.session.add_all([project, user])
+            db.session.commit()
+            self.file_company_id, self.file_project_id, self.file_user_id = company.id, project.id, user.id
+
+    def tearDown(self):
+        with self.file_app.app_context():
+            db.drop_all()
+            db.engine.dispose()
+        os.remove(self.path)
+        super().tearDown()
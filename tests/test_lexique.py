@@ -1,7 +1,14 @@
+from unittest.mock import patch
 from tests.base_test import BaseTestCase
 from models import db
 from models.lexique import LexiqueEntry, LexiqueSuggestion
 from models.user import User
+from services.lexique_service import LexiqueService
+from services.lexique_index import LexiqueIndex, lexique_index, _deletes
+from services.lexique_usage import usage_counter
+from services.version_stamp import VersionStamp
+from models.cache_version import CacheVersion
+from utils.normalization import normalize_term
 
 class TestLexique(BaseTestCase):
     def setUp(self):
@@ -70,3 +77,349 @@ class TestLexique(BaseTestCase):
         # 6. Search again (should be found now)
         response = self.client.get('/lexique/search?q=Inconnu')
         self.assertTrue(response.json['found'])
+
+    def test_exact_index_follows_dictionary_changes(self):
+        entry, score = LexiqueService.search('  CEMENT ')
+        self.assertEqual(entry.id, self.entry.id)
+        self.assertEqual(score, 1.0)
+
+        # Index must be rebuilt after an update
+        LexiqueService.update_entry(self.entry.id, aliases=['Smida'])
+        entry, score = LexiqueService.search('smida')
+        self.assertEqual(entry.id, self.entry.id)
+        self.assertEqual(score, 1.0)
+
+        # ... and after a delete
+        LexiqueService.delete_entry(self.entry.id)
+        entry, score = LexiqueService.search('Ciment')
+        self.assertIsNone(entry)
+
+    def test_usage_counts_are_written_in_batches(self):
+        for _ in range(3):
+            LexiqueService.search('Ciment')
+
+        # Lookups stay read-only until the buffer is flushed
+        self.assertEqual(usage_counter.pending(), {self.entry.id: 3})
+        db.session.expire(self.entry)
+        self.assertEqual(self.entry.usage_count, 0)
+
+        self.assertEqual(usage_counter.flush(), 1)
+        self.assertEqual(usage_counter.pending(), {})
+        db.session.expire(self.entry)
+        self.assertEqual(self.entry.usage_count, 3)
+
+        # Hits of an idle worker are written flush_interval seconds later
+        usage_counter.flush_interval = 0.2
+        LexiqueService.search('Ciment')
+        self.assertEqual(usage_counter.pending(), {self.entry.id: 1})
+        timer = usage_counter._timer
+        timer.join(5)
+        self.assertFalse(timer.is_alive())
+        self.assertEqual(usage_counter.pending(), {})
+        db.session.expire(self.entry)
+        self.assertEqual(self.entry.usage_count, 4)
+
+    def test_substring_search_ranking(self):
+        colle = LexiqueService.add_entry({'fr': 'Colle carrelage'}, 'materiau', ['ciment colle'])
+
+        entry, score = LexiqueService.search('cim')
+        self.assertEqual(entry.id, self.entry.id)
+        self.assertEqual(score, 0.8)
+
+        entry, score = LexiqueService.search('ent col')
+        self.assertEqual(entry.id, colle.id)
+        self.assertEqual(score, 0.7)
+
+        entries = LexiqueService.search_entries('ciment')
+        self.assertEqual([e.id for e in entries], [self.entry.id, colle.id])
+        self.assertEqual(LexiqueService.search_entries('ciment', category='general'), [])
+
+        response = self.client.get('/lexique/?search=carrel')
+        self.assertIn(b'Colle carrelage', response.data)
+
+    def test_fuzzy_matching_tolerates_typos(self):
+        parpaing = LexiqueService.add_entry({'fr': 'Parpaing', 'en': 'Concrete block'}, 'materiau')
+
+        result = LexiqueService.translate('cimnet', to_lang='en')
+        self.assertEqual(result['translation'], 'Cement')
+        self.assertEqual(result['confidence'], 0.6)
+
+        result = LexiqueService.translate('parpin', to_lang='en')
+        self.assertEqual(result['entry_id'], parpaing.id)
+        self.assertEqual(result['confidence'], 0.5)
+
+        # Too many typos for such a short word
+        result = LexiqueService.translate('cmnt', to_lang='en')
+        self.assertEqual(result['source'], 'unknown')
+
+    def test_normalized_matching_across_scripts(self):
+        brique = LexiqueService.add_entry(
+            {'fr': 'Brique rouge', 'ar': 'الآجُرّة', 'dr': "l'7ajar"}, 'materiau'
+        )
+
+        for query in ['الاجرة', 'الأجــره', 'BRIQUE ROUGE', "l’hajar"]:
+            entry, score = LexiqueService.search(query)
+            self.assertEqual(entry.id, brique.id, query)
+            self.assertEqual(score, 1.0, query)
+
+        entry = LexiqueService.add_entry({'fr': 'Béton armé'}, 'materiau')
+        self.assertTrue(entry.matches('beton  arme'))
+        found, score = LexiqueService.search('BETON ARME')
+        self.assertEqual(found.id, entry.id)
+
+    def test_digits_are_folded_in_darija_only(self):
+        # Generic text keeps its digits: a typed prefix normalizes like the full word
+        self.assertEqual(normalize_term('HEA200'), 'hea200')
+        self.assertTrue(normalize_term('HEA200').startswith(normalize_term('HEA2')))
+        self.assertTrue(normalize_term('m3allem').startswith(normalize_term('m3')))
+
+        macon = LexiqueService.add_entry({'fr': 'Maître maçon', 'dr': 'M3allem'}, 'main_oeuvre')
+        for query in ['m3allem', 'maallem']:
+            entry, score = LexiqueService.search(query)
+            self.assertEqual(entry.id, macon.id, query)
+            self.assertEqual(score, 1.0, query)
+        for prefix in ['m3', 'M3al', 'maal']:
+            self.assertEqual([r['id'] for r in LexiqueService.autocomplete(prefix)], [macon.id], prefix)
+        self.assertEqual(LexiqueService.search('2eme'), (None, 0))
+
+    def test_batch_translation_keeps_input_order(self):
+        LexiqueService.add_entry({'fr': 'Sable', 'en': 'Sand'}, 'materiau')
+
+        response = self.client.post('/orders/translate/batch', json={
+            'terms': ['sable', 'Inconnu', 'CIMENT', 'Sable'],
+            'to_lang': 'en'
+        })
+        self.assertEqual(response.status_code, 200)
+        results = response.json['results']
+        self.assertEqual([r['translation'] for r in results], ['Sand', 'Inconnu', 'Cement', 'Sand'])
+        self.assertEqual([r['source'] for r in results],
+                         ['dictionary', 'unknown', 'dictionary', 'dictionary'])
+
+        # Usage is counted once per occurrence
+        self.assertEqual(usage_counter.pending()[self.entry.id], 1)
+        self.assertEqual(sum(usage_counter.pending().values()), 3)
+
+        response = self.client.post('/orders/translate/batch', json={'terms': 'sable'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_line_translation_by_phrase(self):
+        sac = LexiqueService.add_entry({'fr': 'Sac', 'en': 'Bag'}, 'general')
+        colle = LexiqueService.add_entry({'fr': 'Ciment colle', 'en': 'Tile adhesive'}, 'materiau')
+
+        result = LexiqueService.translate_line('Sac ciment 50kg CPJ45', to_lang='en')
+        self.assertEqual(result['translation'], 'Bag Cement 50kg CPJ45')
+        self.assertEqual(result['source'], 'phrase')
+        self.assertEqual(result['confidence'], 0.67)
+        self.assertEqual([s['entry_id'] for s in result['spans']], [sac.id, self.entry.id])
+
+        # Longest match wins over the single word entry, plurals come through fuzzy matching
+        result = LexiqueService.translate_line('2 sacs, ciment colle (gris)', to_lang='en')
+        self.assertEqual(result['translation'], '2 Bag, Tile adhesive (gris)')
+        self.assertEqual([(s['original'], s['confidence']) for s in result['spans']],
+                         [('sacs', 0.6), ('ciment colle', 1.0)])
+        self.assertEqual(result['spans'][1]['entry_id'], colle.id)
+
+        result = LexiqueService.translate_line('ciment', to_lang='en')
+        self.assertEqual(result['source'], 'dictionary')
+        self.assertEqual(result['entry_id'], self.entry.id)
+        self.assertEqual(result['confidence'], 1.0)
+
+    def test_translation_cache_follows_dictionary_version(self):
+        cache = lexique_index.translation_cache
+        version = lexique_index.version
+
+        self.assertEqual(LexiqueService.translate('ciment', to_lang='en')['translation'], 'Cement')
+        self.assertEqual(LexiqueService.translate('CIMENT ', to_lang='en')['translation'], 'Cement')
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        # Any committed change to an entry bumps the version, even outside LexiqueService
+        self.entry.translations = {'fr': 'Ciment', 'en': 'Portland cement'}
+        db.session.commit()
+        self.assertGreater(lexique_index.version, version)
+        self.assertEqual(LexiqueService.translate('ciment', to_lang='en')['translation'], 'Portland cement')
+
+    def test_changes_from_another_worker_are_picked_up(self):
+        lexique_index.stamp.check_interval = 0
+        self.assertIsNone(lexique_index.lookup('sable'))
+        version = lexique_index.version
+
+        # Another worker writes through its own connection and bumps the shared stamp
+        with db.engine.begin() as conn:
+            conn.execute(LexiqueEntry.__table__.insert().values(
+                category='materiau', translations={'fr': 'Sable'}, is_validated=True
+            ))
+            lexique_index.stamp.bump(conn)
+
+        self.assertGreater(lexique_index.version, version)
+        self.assertIsNotNone(lexique_index.lookup('sable'))
+
+        # The stamp row is created and then incremented by the same upsert
+        stamp = VersionStamp('test', check_interval=0)
+        with db.engine.begin() as conn:
+            stamp.bump(conn)
+        created = stamp.current()
+        self.assertEqual(db.session.get(CacheVersion, 'test').version, created)
+        with db.engine.begin() as conn:
+            stamp.bump(conn)
+        self.assertEqual(stamp.current(), created + 1)
+
+        # Local commits bump the stamp once per transaction, in the same transaction
+        stamp = lexique_index.stamp.current()
+        db.session.add(LexiqueEntry(category='materiau', translations={'fr': 'Gravier'}, is_validated=True))
+        db.session.flush()
+        self.entry.aliases = ['ciment gris']
+        db.session.commit()
+        self.assertEqual(lexique_index.stamp.current(), stamp + 1)
+
+    def test_workers_load_the_index_from_the_snapshot(self):
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            lexique_index.snapshot_dir = directory
+            lexique_index.stamp.check_interval = 0
+            LexiqueService.add_entry({'fr': 'Treillis soudé'}, 'materiau', ['tr soude'])
+
+            # The first worker to need the index builds it and writes the snapshot
+            self.assertEqual(lexique_index.lookup('ciment'), self.entry.id)
+            version = lexique_index.stamp.current()
+            self.assertEqual(os.listdir(directory), [f'lexique-{version}.snap'])
+
+            # Other workers load it without reading the dictionary tables
+            worker = LexiqueIndex()
+            worker.snapshot_dir = directory
+            worker.stamp.check_interval = 0
+            worker._build = lambda: self.fail('index rebuilt from the database')
+            self.assertEqual(worker.lookup('CIMENT'), self.entry.id)
+            self.assertEqual(worker.segment('treillis soude 6mm')[0][:2], (0, 14))
+            # Typo-tolerant matching does not rebuild the deletion variants either
+            with patch('services.lexique_index._deletes', wraps=_deletes) as variants:
+                self.assertEqual(worker.search('cimnet', limit=1)[0][0], self.entry.id)
+            self.assertEqual(variants.call_count, 1)
+
+            # A new dictionary version replaces the file
+            LexiqueService.update_entry(self.entry.id, aliases=['sima'])
+            self.assertEqual(lexique_index.lookup('sima'), self.entry.id)
+            self.assertEqual(os.listdir(directory), [f'lexique-{version + 1}.snap'])
+
+            # Truncated files are ignored
+            path = os.path.join(directory, f'lexique-{version + 1}.snap')
+            with open(path, 'r+b') as f:
+                f.truncate(40)
+            del worker._build
+            self.assertEqual(worker.lookup('sima'), self.entry.id)
+
+    def test_browse_pages_with_keyset(self):
+        for i, usage in enumerate([5, 3, 3, 3, 0, 8]):
+            db.session.add(LexiqueEntry(
+                category='materiel' if i % 2 else 'materiau',
+                translations={'fr': f'Outil {i}'}, usage_count=usage, is_validated=True
+            ))
+        db.session.commit()
+
+        seen = []
+        after = None
+        while True:
+            page = LexiqueService.browse_entries(after=after, per_page=3)
+            seen.extend(entry.translations['fr'] for entry in page['entries'])
+            self.assertEqual(page['total'], 7)
+            after = page['next_cursor']
+            if not after:
+                break
+        self.assertEqual(seen, ['Outil 5', 'Outil 0', 'Outil 1', 'Outil 2', 'Outil 3', 'Ciment', 'Outil 4'])
+
+        page = LexiqueService.browse_entries(search='outil', category='materiel', per_page=2, count_limit=2)
+        self.assertEqual([e.translations['fr'] for e in page['entries']], ['Outil 5', 'Outil 1'])
+        self.assertEqual((page['total'], page['total_is_estimate']), (2, True))
+
+        # Beyond max_results, the most used matches are kept and the total is a lower bound
+        capped = LexiqueService.browse_entries(search='outil', max_results=2)
+        self.assertEqual([e.translations['fr'] for e in capped['entries']], ['Outil 5', 'Outil 0'])
+        self.assertEqual((capped['total'], capped['total_is_estimate']), (2, True))
+        capped = LexiqueService.browse_entries(search='outil', category='materiau', max_results=2)
+        self.assertEqual([e.translations['fr'] for e in capped['entries']], ['Outil 0', 'Outil 2'])
+        capped = LexiqueService.browse_entries(search='outil', category='materiau', max_results=3)
+        self.assertEqual((capped['total'], capped['total_is_estimate']), (3, False))
+
+        response = self.client.get(f"/lexique/?search=outil&after={page['next_cursor']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Outil 2', response.data)
+        self.assertNotIn(b'Outil 0', response.data)
+
+    def test_autocomplete_ranks_prefixes_by_usage(self):
+        cimaise = LexiqueService.add_entry({'fr': 'Cimaise', 'en': 'Picture rail'}, 'materiau', [])
+        ciseau = LexiqueService.add_entry({'fr': 'Ciseau', 'ar': 'إزميل'}, 'materiel', ['cisaille'])
+        self.entry.usage_count = 12
+        db.session.commit()
+
+        response = self.client.get('/lexique/autocomplete?q=ci')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+        etag = response.headers['ETag']
+        results = response.json['results']
+        self.assertEqual([r['text'] for r in results], ['Ciment', 'Ciseau', 'Cimaise'])
+        # One completion per entry, with its French label
+        self.assertEqual(results[1]['translation'], 'Ciseau')
+
+        results = self.client.get('/lexique/autocomplete?q=c&lang=en').json['results']
+        self.assertEqual([(r['text'], r['lang']) for r in results], [('Cement', 'en')])
+
+        results = self.client.get('/lexique/autocomplete?q=cisa&limit=5').json['results']
+        self.assertEqual([r['text'] for r in results], ['cisaille'])
+
+        self.assertEqual(self.client.get('/lexique/autocomplete?q=ci&lang=xx').status_code, 400)
+
+        # Usage written behind the index reorders the completions without a rebuild
+        version = lexique_index.version
+        usage_counter.record(cimaise.id, 20)
+        usage_counter.flush()
+        results = self.client.get('/lexique/autocomplete?q=ci').json['results']
+        self.assertEqual([r['text'] for r in results], ['Cimaise', 'Ciment', 'Ciseau'])
+
+        # Hits flushed by another worker are read again after LEXIQUE_USAGE_REFRESH_INTERVAL
+        db.session.execute(db.update(LexiqueEntry).where(LexiqueEntry.id == ciseau.id).values(usage_count=50))
+        db.session.commit()
+        lexique_index.usage_refresh_interval = 0
+        results = self.client.get('/lexique/autocomplete?q=ci').json['results']
+        self.assertEqual([r['text'] for r in results], ['Ciseau', 'Cimaise', 'Ciment'])
+        self.assertEqual(lexique_index.version, version)
+
+        # The browser revalidates: 304 until the dictionary or the ranking changes
+        response = self.client.get('/lexique/autocomplete?q=ci')
+        self.assertNotEqual(response.headers['ETag'], etag)
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get('/lexique/autocomplete?q=ci', headers={'If-None-Match': etag}).status_code, 304)
+        LexiqueService.add_entry({'fr': 'Cintre'}, 'materiel', [])
+        response = self.client.get('/lexique/autocomplete?q=ci', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cintre', [r['text'] for r in response.json['results']])
+
+    def test_benchmark_harness(self):
+        import os
+        import tempfile
+        from scripts.benchmark_lexique import compare, load_baseline, main, run_benchmark, save_baseline
+
+        results = run_benchmark(sizes=[200], queries=50, log=lambda message: None)
+        self.assertEqual(set(results['200']), {'sql_scan', 'search', 'translate', 'browse', 'autocomplete'})
+        metrics = results['200']['search']
+        self.assertGreater(metrics['qps'], 0)
+        self.assertLessEqual(metrics['p50_ms'], metrics['p99_ms'])
+        self.assertEqual(results['200']['autocomplete']['sql_per_query'], 0)
+        self.assertEqual((results['200']['sql_scan']['sql_per_query'], results['200']['sql_scan']['speedup']), (1, 1))
+
+        # Regression mode flags a lost speedup over the SQL scan and extra statements
+        baseline = {'200': {'search': dict(metrics, speedup=metrics['speedup'] * 10, sql_per_query=0)}}
+        self.assertEqual(len(compare(results, baseline, tolerance=1.5)), 2)
+        self.assertEqual(compare(results, results, tolerance=1.0), [])
+
+        # The baseline only keeps machine-independent metrics and records the replayed mix,
+        # --check refuses another one
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            save_baseline(path, results, 50, 0)
+            settings, saved = load_baseline(path)
+            self.assertEqual(settings, {'queries': 50, 'seed': 0})
+            self.assertEqual(saved['200']['search'], {'sql_per_query': metrics['sql_per_query'],
+                                                      'speedup': metrics['speedup']})
+            with self.assertRaises(SystemExit):
+                main(['--check', '--baseline', path, '--queries', '2000'])
@@ -66,3 +66,164 @@ class TestLexiqueImport(BaseTestCase):
         suggestion = LexiqueSuggestion.query.filter_by(original_term='Brique').first()
         self.assertIsNotNone(suggestion)
         self.assertEqual(suggestion.suggested_translations['en'], 'Brick')
+
+    def test_bulk_import_report(self):
+        from services.lexique_service import LexiqueService
+        from utils.tabular import iter_rows
+
+        csv_content = (
+            "FR;EN;Category\n"
+            "Gravier;Gravel;materiau\n"
+            ";Sand;materiau\n"
+            ";;\n"
+            "GRAVIER;Gravel;materiau\n"
+            "Treillis soudé;Welded mesh;\n"
+            "Parpaing;Block;materiau\n"
+        )
+        with self.app.test_request_context():
+            from flask_login import login_user
+            login_user(self.super_admin)
+            report = LexiqueService.import_suggestions(
+                iter_rows(io.BytesIO(csv_content.encode('utf-8')), 'glossaire.csv'),
+                chunk_size=2
+            )
+
+        self.assertEqual(report['created'], 3)
+        self.assertEqual(report['invalid'], 1)
+        self.assertEqual(report['skipped'], 1)
+        self.assertEqual(report['duplicate'], 1)
+        self.assertEqual(
+            [(row['line'], row['status']) for row in report['rows']],
+            [(3, 'invalid'), (4, 'skipped'), (5, 'duplicate')]
+        )
+
+        suggestion = LexiqueSuggestion.query.filter_by(original_term='Treillis soudé').one()
+        self.assertEqual(suggestion.category, 'general')
+        self.assertEqual(suggestion.suggested_translations, {'fr': 'Treillis soudé', 'en': 'Welded mesh'})
+        self.assertIsNotNone(suggestion.created_at)
+
+    def test_bulk_import_merges_duplicates(self):
+        from models.lexique import LexiqueEntry
+        from services.lexique_service import LexiqueService
+
+        db.session.add(LexiqueEntry(category='materiau', translations={'fr': 'Ciment'}, is_validated=True))
+        db.session.add(LexiqueSuggestion(
+            suggested_by_id=self.super_admin.id, original_term='Sable',
+            suggested_translations={'fr': 'Sable', 'en': 'Sand'}, status='pending'
+        ))
+        db.session.commit()
+
+        csv_content = "fr,en,ar,dr\nciment,Cement,,\nSABLE,Sand!,رمل,\nTuile,Tile,,\ntuile,,,9armoud\n"
+        for _ in range(2):
+            data = {'file': (io.BytesIO(csv_content.encode('utf-8')), 'test.csv')}
+            response = self.client.post('/lexique/admin/import', data=data,
+                                        content_type='multipart/form-data', follow_redirects=True)
+            self.assertEqual(response.status_code, 200)
+
+        # Re-uploading the same glossary does not grow the review queue
+        self.assertEqual(LexiqueSuggestion.query.filter_by(status='pending').count(), 2)
+        self.assertEqual(LexiqueSuggestion.query.filter_by(original_term='ciment').count(), 0)
+
+        sable = LexiqueSuggestion.query.filter_by(original_term='Sable').one()
+        self.assertEqual(sable.suggested_translations, {'fr': 'Sable', 'en': 'Sand', 'ar': 'رمل'})
+        tuile = LexiqueSuggestion.query.filter_by(original_term='Tuile').one()
+        self.assertEqual(tuile.suggested_translations, {'fr': 'Tuile', 'en': 'Tile', 'dr': '9armoud'})
+
+        # A suggestion from the form finds the imported one by its normalized term
+        self.assertEqual(tuile.normalized_term, 'tuile')
+        self.client.post('/lexique/suggest', data={
+            'original_term': 'TUILE', 'translation_fr': 'TUILE', 'translation_ar': 'قرميد'
+        }, follow_redirects=True)
+        self.assertEqual(LexiqueSuggestion.query.filter_by(status='pending').count(), 2)
+        db.session.refresh(tuile)
+        self.assertEqual(tuile.suggested_translations['ar'], 'قرميد')
+
+        # Suggestions written before the column existed are backfilled
+        db.session.execute(db.update(LexiqueSuggestion).values(normalized_term=None))
+        db.session.commit()
+        self.assertEqual(LexiqueService.backfill_normalized_terms(batch_size=1), 2)
+        self.assertEqual(db.session.get(LexiqueSuggestion, sable.id).normalized_term, 'sable')
+
+    def test_bulk_moderation(self):
+        suggestions = [
+            LexiqueSuggestion(
+                suggested_by_id=self.super_admin.id, original_term=term, category=category,
+                suggested_translations={'fr': term}, status='pending'
+            )
+            for term, category in [('Agglo', 'materiau'), ('Bétonnière', 'materiel'),
+                                   ('Chape', 'materiau'), ('Dalle', 'general')]
+        ]
+        db.session.add_all(suggestions)
+        db.session.commit()
+        agglo, betonniere, chape, dalle = [s.id for s in suggestions]
+
+        response = self.client.post('/lexique/admin/suggestions/bulk', data={
+            'action': 'approve', 'suggestion_ids': [agglo, betonniere]
+        }, follow_redirects=True)
+        self.assertIn(b'2 suggestions approuv', response.data)
+
+        response = self.client.post('/lexique/admin/suggestions/bulk', data={
+            'action': 'reject', 'scope': 'all', 'category': 'materiau', 'notes': 'Doublon'
+        }, follow_redirects=True)
+        self.assertIn(b'1 suggestions rejet', response.data)
+
+        db.session.expire_all()
+        for suggestion_id in (agglo, betonniere):
+            suggestion = db.session.get(LexiqueSuggestion, suggestion_id)
+            self.assertEqual(suggestion.status, 'approved')
+            self.assertEqual(suggestion.lexique_entry.translations, {'fr': suggestion.original_term})
+        self.assertEqual(db.session.get(LexiqueSuggestion, chape).status, 'rejected')
+        self.assertEqual(db.session.get(LexiqueSuggestion, chape).review_notes, 'Doublon')
+        self.assertEqual(db.session.get(LexiqueSuggestion, dalle).status, 'pending')
+
+        from services.lexique_service import LexiqueService
+        entry, score = LexiqueService.search('betonniere')
+        self.assertEqual(entry.id, db.session.get(LexiqueSuggestion, betonniere).lexique_entry_id)
+
+    def _count_statements(self, func, *args):
+        with self.capture_statements() as statements:
+            result = func(*args)
+        return result, statements
+
+    def test_approval_links_entry_in_one_flush(self):
+        from flask_login import login_user
+        from services.lexique_service import LexiqueService
+
+        def add_suggestions(count, prefix):
+            suggestions = [
+                LexiqueSuggestion(
+                    suggested_by_id=self.super_admin.id, original_term=f'{prefix} {i}',
+                    suggested_translations={'fr': f'{prefix} {i}'}, category='materiau', status='pending'
+                )
+                for i in range(count)
+            ]
+            db.session.add_all(suggestions)
+            db.session.commit()
+            return [s.id for s in suggestions]
+
+        with self.app.test_request_context():
+            login_user(self.super_admin)
+
+            suggestion_id, = add_suggestions(1, 'Poutre')
+            entry, single = self._count_statements(LexiqueService.approve_suggestion, suggestion_id)
+            db.session.expire_all()
+            self.assertEqual(db.session.get(LexiqueSuggestion, suggestion_id).lexique_entry_id, entry.id)
+
+            few, few_statements = self._count_statements(LexiqueService.approve_many, add_suggestions(3, 'Linteau'))
+            many, many_statements = self._count_statements(LexiqueService.approve_many, add_suggestions(30, 'Poteau'))
+
+        # One SELECT, one executemany UPDATE of the suggestions and the version stamp
+        # whatever the batch size; entries are a single multi-row INSERT where the
+        # dialect can return their ids in order (PostgreSQL), one per row otherwise
+        def split(statements):
+            inserts = [s for s in statements if s.startswith('INSERT INTO lexique_entries')]
+            return len(inserts), len(statements) - len(inserts)
+
+        self.assertEqual(split(single)[0], 1)
+        self.assertEqual(split(few_statements)[1], split(many_statements)[1])
+        self.assertEqual(len([s for s in many_statements if s.startswith('UPDATE lexique_suggestions')]), 1)
+        self.assertEqual(split(many_statements)[0], 1 if db.engine.dialect.name == 'postgresql' else 30)
+
+        db.session.expire_all()
+        linked = LexiqueSuggestion.query.filter(LexiqueSuggestion.original_term.like('Poteau%')).all()
+        self.assertEqual(sorted(s.lexique_entry_id for s in linked), sorted(e.id for e in many))
@@ -0,0 +1,76 @@
+import threading
+from datetime import datetime
+from tests.base_test import BaseTestCase, FileDatabaseTestCase
+from models import db
+from models.company import Company
+from models.order import Order
+from models.bc_sequence import BcSequence
+from services.numbering_service import NumberingService
+
+class TestNumbering(BaseTestCase):
+    def allocate(self, count=1, now=datetime(2026, 3, 1)):
+        numbers = NumberingService.allocate(self.company, count, now=now)
+        db.session.commit()
+        return numbers
+
+    def test_numbers_restart_every_year(self):
+        self.assertEqual(self.allocate(), ['BC-2026-001'])
+        self.assertEqual(self.allocate(3), ['BC-2026-002', 'BC-2026-003', 'BC-2026-004'])
+        self.assertEqual(self.allocate(now=datetime(2027, 1, 2)), ['BC-2027-001'])
+        self.assertEqual(self.allocate(), ['BC-2026-005'])
+
+    def test_settings_and_legacy_counter(self):
+        # Numbers given by the former counter are never reused
+        self.company.bc_counter = 41
+        self.company.settings = {'numbering': {'prefix': 'CMD', 'year_format': 'YY', 'sequence_length': 4}}
+        db.session.commit()
+        self.assertEqual(self.allocate(), ['CMD-26-0042'])
+        self.assertEqual(self.allocate(now=datetime(2027, 1, 2)), ['CMD-27-0001'])
+
+        # Raising start_number jumps ahead, lowering it does not go back
+        self.company.settings = {'numbering': {'year_format': 'YY', 'start_number': 100}}
+        db.session.commit()
+        self.assertEqual(self.allocate(), ['BC-26-100'])
+        # Unknown year formats are formatted as YY and keep the yearly counter
+        self.company.settings = {'numbering': {'year_format': 'AA', 'start_number': 1}}
+        db.session.commit()
+        self.assertEqual(self.allocate(), ['BC-26-101'])
+
+    def test_rollback_gives_the_number_back(self):
+        NumberingService.allocate(self.company, now=datetime(2026, 3, 1))
+        db.session.rollback()
+        self.assertEqual(self.allocate(), ['BC-2026-001'])
+        self.assertEqual(BcSequence.query.count(), 1)
+
+
+class TestConcurrentNumbering(FileDatabaseTestCase):
+    WORKERS = 8
+    ORDERS_PER_WORKER = 10
+
+    def create_orders(self, errors):
+        try:
+            with self.file_app.app_context():
+                for _ in range(self.ORDERS_PER_WORKER):
+                    company = db.session.get(Company, self.file_company_id)
+                    bc_number = NumberingService.allocate(company)[0]
+                    db.session.add(Order(company_id=company.id, project_id=self.file_project_id,
+                                         bc_number=bc_number, status='BROUILLON',
+                                         created_by_id=self.file_user_id))
+                    db.session.commit()
+        except Exception as exc:
+            errors.append(exc)
+
+    def test_concurrent_orders_get_distinct_numbers(self):
+        errors = []
+        threads = [threading.Thread(target=self.create_orders, args=(errors,)) for _ in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        with self.file_app.app_context():
+            numbers = sorted(int(bc_number.rsplit('-', 1)[1])
+                             for bc_number in db.session.scalars(db.select(Order.bc_number)))
+        # No duplicate and no gap
+        self.assertEqual(numbers, list(range(1, self.WORKERS * self.ORDERS_PER_WORKER + 1)))
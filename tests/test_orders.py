@@ -0,0 +1,274 @@
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from tests.base_test import BaseTestCase, FileDatabaseTestCase
+from models import db
+from models.project import Project
+from models.order import Order, OrderLine, OrderHistory
+from services.order_service import OrderService
+
+class TestOrderTotals(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project(name="Project A", company_id=self.company.id)
+        db.session.add(self.project)
+        db.session.commit()
+
+        self.client.post('/auth/login', data={
+            'email': 'test@test.com',
+            'password': 'password'
+        }, follow_redirects=True)
+
+        self.client.post('/orders/create', data={'project_id': self.project.id})
+        self.order = Order.query.first()
+
+    def add_line(self, quantity, unit_price):
+        self.client.post(f'/orders/{self.order.id}/edit', data={
+            'action': 'add_line',
+            'description': 'Ciment',
+            'quantity': quantity,
+            'unit_price': unit_price
+        })
+
+    def totals(self):
+        order = db.session.get(Order, self.order.id)
+        db.session.refresh(order)
+        return order.line_count, order.total_ht, order.total_ttc
+
+    def test_line_changes_maintain_totals(self):
+        self.add_line('3', '0.1')
+        self.add_line('2.5', '19.99')
+        self.add_line('4', '')
+        # 0.30 + 49.98 (49.975 rounded half up) + 0
+        self.assertEqual(self.totals(), (3, Decimal('50.28'), Decimal('60.34')))
+
+        line = OrderLine.query.filter_by(line_number=1).one()
+        OrderService.update_line(line, quantity=10)
+        self.assertEqual(self.totals(), (3, Decimal('50.98'), Decimal('61.18')))
+
+        self.client.post(f'/orders/{self.order.id}/line/{line.id}/delete')
+        self.assertEqual(self.totals(), (2, Decimal('49.98'), Decimal('59.98')))
+        self.assertEqual([l.line_number for l in OrderLine.query.order_by(OrderLine.line_number)], [1, 2])
+
+    def test_recompute_fixes_stored_totals(self):
+        self.add_line('2', '10')
+        # Lines written without OrderService
+        db.session.add(OrderLine(order_id=self.order.id, line_number=2, description='Sable', quantity=1, unit_price=5))
+        db.session.commit()
+
+        self.assertEqual(OrderService.recompute_totals(missing_only=True), 0)
+        self.assertEqual(OrderService.recompute_totals(), 1)
+        self.assertEqual(self.totals(), (2, Decimal('25.00'), Decimal('30.00')))
+        self.assertEqual(OrderService.recompute_totals(), 0)
+
+    def test_listing_does_not_read_order_lines(self):
+        self.add_line('2', '10')
+        with self.capture_statements() as statements:
+            response = self.client.get('/orders/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'20.00', response.data)
+        self.assertFalse([s for s in statements if 'order_lines' in s])
+
+
+
+class TestConcurrentLineChanges(FileDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.file_app.app_context():
+            order = Order(company_id=self.file_company_id, project_id=self.file_project_id,
+                          bc_number="BC-0001", created_by_id=self.file_user_id)
+            db.session.add(order)
+            db.session.commit()
+            self.order_id = order.id
+
+    def test_interleaved_sessions_keep_every_line(self):
+        loaded = threading.Barrier(2)
+        errors = []
+
+        def add_lines(unit_price):
+            try:
+                with self.file_app.app_context():
+                    order = db.session.get(Order, self.order_id)
+                    # Both sessions hold the order as it was before any line was added
+                    self.assertEqual((order.line_count, order.total_ht), (0, 0))
+                    loaded.wait()
+                    for _ in range(3):
+                        OrderService.add_line(order, 'Ciment', 2, unit_price=unit_price)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=add_lines, args=(price,)) for price in ('10', '0.5')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        with self.file_app.app_context():
+            order = db.session.get(Order, self.order_id)
+            self.assertEqual((order.line_count, order.total_ht, order.total_ttc),
+                             (6, Decimal('63.00'), Decimal('75.60')))
+            numbers = sorted(line.line_number for line in order.lines)
+            self.assertEqual(numbers, [1, 2, 3, 4, 5, 6])
+
+            # A deletion renumbers the following lines and takes its subtotal off
+            OrderService.delete_line(order.lines.filter_by(line_number=2).one())
+            order = db.session.get(Order, self.order_id)
+            self.assertEqual((order.line_count, sorted(line.line_number for line in order.lines)),
+                             (5, [1, 2, 3, 4, 5]))
+            self.assertIn(order.total_ht, (Decimal('43.00'), Decimal('62.00')))
+
+class TestOrderListing(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.post('/auth/login', data={
+            'email': 'test@test.com',
+            'password': 'password'
+        }, follow_redirects=True)
+        self.created = 0
+        self.company_id, self.user_id = self.company.id, self.user.id
+
+    def create_orders(self, count):
+        created = []
+        for _ in range(count):
+            self.created += 1
+            # Archived projects are not preloaded by the project filter of the page
+            project = Project(name=f"Project {self.created}", company_id=self.company_id, is_active=False)
+            db.session.add(project)
+            db.session.flush()
+            order = Order(company_id=self.company_id, project_id=project.id, bc_number=f"BC-{self.created:04d}",
+                          created_by_id=self.user_id, total_ht=10, total_ttc=12, line_count=1)
+            db.session.add(order)
+            db.session.flush()
+            history = OrderHistory(order_id=order.id, user_id=self.user_id, action='CREATION', new_status='BROUILLON')
+            db.session.add(history)
+            created += [project, order, history]
+        db.session.commit()
+        # Out of the identity map: the page has to load them itself
+        for obj in created:
+            db.session.expunge(obj)
+
+    def count_listing_queries(self):
+        with self.capture_statements() as statements:
+            response = self.client.get('/orders/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'BC-{self.created:04d}'.encode(), response.data)
+        return len(statements)
+
+    def test_query_count_does_not_depend_on_row_count(self):
+        self.create_orders(3)
+        few = self.count_listing_queries()
+        self.create_orders(30)
+        self.assertEqual(self.count_listing_queries(), few)
+
+    def walk_pages(self, **params):
+        references, after = [], None
+        while True:
+            response = self.client.get('/orders/page', query_string={**params, 'after': after or ''})
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            self.assertLessEqual(len(data['orders']), 3)
+            references += [order['bc_number'] for order in data['orders']]
+            after = data['next_cursor']
+            if not after:
+                return references
+
+    def test_keyset_pagination_with_filters_and_sorts(self):
+        self.app.config['ORDERS_PAGE_SIZE'] = 3
+        self.create_orders(8)
+        # Ties on created_at are broken by id
+        same_time = datetime(2026, 1, 1, 12, 0)
+        db.session.execute(db.update(Order).where(Order.id <= 4).values(created_at=same_time))
+        db.session.execute(db.update(Order).where(Order.id > 4).values(created_at=same_time + timedelta(days=1)))
+        db.session.execute(db.update(Order).where(Order.id.in_([2, 5, 7])).values(status='SOUMIS'))
+        for order_id, amount in [(1, 50), (2, 10), (3, 30), (4, 10), (5, 80), (6, 0), (7, 20), (8, 60)]:
+            db.session.execute(db.update(Order).where(Order.id == order_id).values(total_ht=amount))
+        db.session.commit()
+
+        self.assertEqual(self.walk_pages(), [f'BC-{i:04d}' for i in (8, 7, 6, 5, 4, 3, 2, 1)])
+        self.assertEqual(self.walk_pages(direction='asc'), [f'BC-{i:04d}' for i in range(1, 9)])
+        self.assertEqual(self.walk_pages(sort='amount', direction='asc'),
+                         [f'BC-{i:04d}' for i in (6, 2, 4, 7, 3, 1, 8, 5)])
+        self.assertEqual(self.walk_pages(status='SOUMIS'), ['BC-0007', 'BC-0005', 'BC-0002'])
+        project_id = db.session.get(Order, 3).project_id
+        self.assertEqual(self.walk_pages(project_id=project_id), ['BC-0003'])
+
+        # The HTML page shows the first page, the counts of the whole list and the next link
+        response = self.client.get('/orders/')
+        self.assertIn(b"window.location='/orders/6'", response.data)
+        self.assertNotIn(b"window.location='/orders/5'", response.data)
+        self.assertIn(b'8 commande(s)', response.data)
+        self.assertIn(b'id="orders-next"', response.data)
+        response = self.client.get('/orders/', query_string={'status': 'SOUMIS'})
+        self.assertIn(b'3 commande(s)', response.data)
+        self.assertNotIn(b'id="orders-next"', response.data)
+
+        # A cursor of another sort, or garbage, restarts from the first page
+        first = self.client.get('/orders/page').get_json()
+        response = self.client.get('/orders/page', query_string={'sort': 'amount', 'after': first['next_cursor']})
+        self.assertEqual(response.get_json()['orders'][0]['bc_number'], 'BC-0005')
+        response = self.client.get('/orders/page', query_string={'after': 'not-a-cursor'})
+        self.assertEqual(response.get_json()['orders'][0]['bc_number'], 'BC-0008')
+
+
+class TestOrderTransitions(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project(name="Project A", company_id=self.company.id)
+        db.session.add(self.project)
+        db.session.commit()
+
+        self.client.post('/auth/login', data={
+            'email': 'test@test.com',
+            'password': 'password'
+        }, follow_redirects=True)
+
+    def count_commits(self, method, url, **kwargs):
+        commits = []
+
+        def count_commit(session):
+            commits.append(session)
+
+        event.listen(Session, 'after_commit', count_commit)
+        try:
+            getattr(self.client, method)(url, **kwargs)
+        finally:
+            event.remove(Session, 'after_commit', count_commit)
+        return len(commits)
+
+    def test_each_transition_commits_once_with_its_history(self):
+        self.assertEqual(self.count_commits('post', '/orders/create', data={'project_id': self.project.id}), 1)
+        order = Order.query.one()
+        self.assertEqual(self.count_commits('post', f'/orders/{order.id}/edit', data={
+            'action': 'add_line', 'description': 'Ciment', 'quantity': '2', 'unit_price': '10'
+        }), 1)
+        self.assertEqual(self.count_commits('post', f'/orders/{order.id}/submit'), 1)
+        self.assertEqual(self.count_commits('post', f'/orders/{order.id}/reject', data={'reason': 'Prix'}), 1)
+
+        actions = db.session.scalars(
+            db.select(OrderHistory.action).where(OrderHistory.order_id == order.id).order_by(OrderHistory.id)
+        ).all()
+        self.assertEqual(actions, ['CREATION', 'SOUMISSION', 'REJET'])
+
+    def test_failed_history_rolls_back_the_transition(self):
+        self.client.post('/orders/create', data={'project_id': self.project.id})
+        order = Order.query.one()
+        self.client.post(f'/orders/{order.id}/edit', data={
+            'action': 'add_line', 'description': 'Ciment', 'quantity': '2', 'unit_price': '10'
+        })
+
+        with patch.object(OrderService, 'add_history', side_effect=RuntimeError("history unavailable")):
+            self.client.post(f'/orders/{order.id}/submit')
+            self.client.post('/orders/create', data={'project_id': self.project.id})
+
+        db.session.refresh(order)
+        self.assertEqual(order.status, 'BROUILLON')
+        self.assertEqual(Order.query.count(), 1)
+        # The number reserved by the failed creation is given back
+        self.client.post('/orders/create', data={'project_id': self.project.id})
+        self.assertEqual(
+            db.session.scalars(db.select(Order.bc_number).order_by(Order.id)).all()[-1][-3:], '002'
+        )
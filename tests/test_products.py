@@ -0,0 +1,275 @@
+import io
+from unittest.mock import patch
+from sqlalchemy import false, select
+from tests.base_test import BaseTestCase
+from models import db
+from models.project import Project
+from models.company import Company
+from models.product import Product, PRODUCTS_FTS_TRIGGERS
+from services.product_search import ProductSearch
+from services.product_service import ProductService
+from utils.tabular import iter_rows
+
+class TestProductSearch(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_company = Company(name="Other Company", ice="987654321")
+        db.session.add(self.other_company)
+        db.session.commit()
+
+        db.session.add_all([
+            Product(company_id=self.company.id, reference="CIM-045", category="materiau",
+                    labels={'fr': 'Ciment CPJ 45', 'en': 'Cement', 'ar': 'إسمنت'}),
+            Product(company_id=self.company.id, reference="PLQ-13", category="materiau",
+                    labels={'fr': 'Plaque de plâtre BA13', 'en': 'Plasterboard'}),
+            Product(company_id=self.company.id, reference="TUB-100", category="materiau",
+                    labels={'fr': 'Tube PVC 100%'}),
+            Product(company_id=self.other_company.id, reference="CIM-OTHER", category="materiau",
+                    labels={'fr': 'Ciment blanc'}),
+        ])
+        db.session.commit()
+
+        self.client.post('/auth/login', data={
+            'email': 'test@test.com',
+            'password': 'password'
+        }, follow_redirects=True)
+
+    def search(self, query):
+        response = self.client.get('/products/search', query_string={'q': query})
+        self.assertEqual(response.status_code, 200)
+        return sorted(product['reference'] for product in response.get_json())
+
+    def test_search_matches_reference_and_labels(self):
+        self.assertEqual(self.search('ciment'), ['CIM-045'])
+        # Accents and case are ignored, in every language
+        self.assertEqual(self.search('PLATRE'), ['PLQ-13'])
+        self.assertEqual(self.search('plasterb'), ['PLQ-13'])
+        self.assertEqual(self.search('إسمنت'), ['CIM-045'])
+        self.assertEqual(self.search('cim-0'), ['CIM-045'])
+        # Short terms and LIKE wildcards
+        self.assertEqual(self.search('13'), ['PLQ-13'])
+        self.assertEqual(self.search('0%'), ['TUB-100'])
+        self.assertEqual(self.search('introuvable'), [])
+
+    def test_search_partial_references_ending_in_a_digit(self):
+        db.session.add_all([
+            Product(company_id=self.company.id, reference="HEA200", labels={'fr': 'Poutrelle HEA 200'}),
+            Product(company_id=self.company.id, reference="IPE80", labels={'fr': 'Poutrelle IPE 80'}),
+            Product(company_id=self.company.id, reference="T8", labels={'fr': 'Fer tor'}),
+        ])
+        db.session.commit()
+
+        for query in ['HEA2', 'HEA20', 'hea200']:
+            self.assertEqual(self.search(query), ['HEA200'], query)
+        self.assertEqual(self.search('IPE8'), ['IPE80'])
+        self.assertEqual(self.search('T8'), ['T8'])
+
+    def test_search_follows_updates_and_deletes(self):
+        product = Product.query.filter_by(reference="PLQ-13").first()
+        product.set_label('fr', 'Plaque hydrofuge')
+        db.session.commit()
+        self.assertEqual(self.search('platre'), [])
+        self.assertEqual(self.search('hydrofuge'), ['PLQ-13'])
+
+        db.session.delete(product)
+        db.session.commit()
+        self.assertEqual(self.search('hydrofuge'), [])
+
+    def test_rebuild_backfills_search_text(self):
+        db.session.execute(db.update(Product).values(search_text=None))
+        db.session.commit()
+
+        self.assertEqual(ProductSearch.rebuild(), 4)
+        self.assertEqual(self.search('ciment'), ['CIM-045'])
+
+    def test_install_upgrades_a_populated_database(self):
+        # As created before search_text: no FTS table, no triggers, the column added empty
+        for name in PRODUCTS_FTS_TRIGGERS:
+            db.session.execute(db.text(f'DROP TRIGGER {name}'))
+        db.session.execute(db.text('DROP TABLE products_fts'))
+        db.session.execute(db.update(Product).values(search_text=None))
+        db.session.commit()
+
+        with db.engine.begin() as connection:
+            self.assertEqual(ProductSearch.install(connection), 4)
+        self.assertEqual(self.search('ciment'), ['CIM-045'])
+
+        # The triggers keep the index in sync with later edits
+        product = Product.query.filter_by(reference="PLQ-13").first()
+        product.set_label('fr', 'Plaque hydrofuge')
+        db.session.commit()
+        self.assertEqual(self.search('hydrofuge'), ['PLQ-13'])
+        self.assertEqual(self.search('platre'), [])
+        db.session.execute(db.text("INSERT INTO products_fts(products_fts, rank) VALUES ('integrity-check', 1)"))
+        db.session.commit()
+
+
+class TestProductCatalog(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_company = Company(name="Other Company", ice="987654321")
+        db.session.add(self.other_company)
+        db.session.commit()
+
+        db.session.add_all([
+            Product(company_id=self.company.id, reference="CIM-045", unit="sac", unit_price=65,
+                    labels={'fr': 'Ciment CPJ 45'}),
+            Product(company_id=self.company.id, reference="OLD-1", is_active=False,
+                    labels={'fr': 'Article retiré'}),
+            Product(company_id=self.other_company.id, reference="SAB-1", labels={'fr': 'Sable'}),
+        ])
+        db.session.commit()
+
+        self.client.post('/auth/login', data={
+            'email': 'test@test.com',
+            'password': 'password'
+        }, follow_redirects=True)
+
+    def test_catalog_is_cached_until_a_product_changes(self):
+        response = self.client.get('/products/catalog')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'products': [{
+            'id': 1, 'reference': 'CIM-045', 'labels': {'fr': 'Ciment CPJ 45'}, 'unit': 'sac', 'unit_price': 65.0
+        }]})
+        etag = response.headers['ETag']
+
+        # Served from the cache: no query on the products table
+        with self.capture_statements() as statements:
+            response = self.client.get('/products/catalog', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([s for s in statements if 'FROM products' in s])
+
+        # Another company's products do not change this catalog
+        product = Product.query.filter_by(reference="SAB-1").first()
+        product.unit_price = 200
+        db.session.commit()
+        self.assertEqual(self.client.get('/products/catalog', headers={'If-None-Match': etag}).status_code, 304)
+
+        self.client.post('/products/add', data={'reference': 'BRQ-1', 'label_fr': 'Brique', 'unit': 'unite'})
+        response = self.client.get('/products/catalog', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['reference'] for p in response.get_json()['products']], ['BRQ-1', 'CIM-045'])
+
+    def test_edit_page_lazy_loads_the_catalog(self):
+        project = Project(name="Chantier", company_id=self.company.id)
+        db.session.add(project)
+        db.session.commit()
+
+        response = self.client.post('/orders/create', data={'project_id': project.id}, follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'data-catalog-url="/products/catalog?company_id={self.company.id}"'.encode(), response.data)
+        self.assertNotIn('Ciment CPJ 45'.encode(), response.data)
+
+
+class TestProductImportExport(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add(Product(company_id=self.company.id, reference="CIM-045", unit="sac", unit_price=60,
+                               labels={'fr': 'Ciment CPJ 45', 'ar': 'إسمنت'}))
+        db.session.commit()
+
+        self.client.post('/auth/login', data={
+            'email': 'test@test.com',
+            'password': 'password'
+        }, follow_redirects=True)
+
+    def test_import_upserts_on_reference(self):
+        csv_content = (
+            "reference;category;unit;unit_price;fr;en\n"
+            "CIM-045;;;65,50;;Cement\n"
+            "SAB-1;materiau;m3;200;Sable de rivière;River sand\n"
+            "SAB-1;;;210;;\n"
+            "BRQ-1;;;;;Brick\n"
+            "GRV-1;;;abc;Gravier;\n"
+            ";;;;;\n"
+            "PEL-1;materiel;jour;1500;Pelle hydraulique;\n"
+        )
+        data = {'file': (io.BytesIO(csv_content.encode('utf-8')), 'catalogue.csv')}
+        report = ProductService.import_catalog(
+            iter_rows(io.BytesIO(csv_content.encode('utf-8')), 'catalogue.csv'), self.company.id, chunk_size=2
+        )
+
+        # SAB-1 is created by the first chunk and updated by the second
+        self.assertEqual((report['created'], report['updated'], report['invalid'], report['skipped']), (2, 2, 2, 1))
+        self.assertEqual([(row['line'], row['reason']) for row in report['rows']], [
+            (5, "Libellé français manquant"), (6, "Prix unitaire invalide"), (7, "Ligne vide")
+        ])
+
+        cement = Product.query.filter_by(reference="CIM-045").one()
+        self.assertEqual(cement.labels, {'fr': 'Ciment CPJ 45', 'ar': 'إسمنت', 'en': 'Cement'})
+        self.assertEqual((cement.unit, float(cement.unit_price)), ('sac', 65.5))
+        sand = Product.query.filter_by(reference="SAB-1").one()
+        self.assertEqual((sand.unit, float(sand.unit_price)), ('m3', 210.0))
+        self.assertEqual(Product.query.count(), 3)
+
+        # Imported products are searchable and in the cached catalog
+        response = self.client.get('/products/search', query_string={'q': 'riviere'})
+        self.assertEqual([product['reference'] for product in response.get_json()], ['SAB-1'])
+        catalog = self.client.get('/products/catalog').get_json()
+        self.assertEqual([product['reference'] for product in catalog['products']], ['CIM-045', 'PEL-1', 'SAB-1'])
+
+        response = self.client.post('/products/import', data=data, content_type='multipart/form-data',
+                                    follow_redirects=True)
+        self.assertIn(b'0 articles cr', response.data)
+
+    def test_import_upsert_keeps_one_active_state_per_reference(self):
+        cement = Product.query.filter_by(reference="CIM-045").one()
+        cement.is_active = False
+        db.session.commit()
+
+        def import_rows(csv_content):
+            return ProductService.import_catalog(
+                iter_rows(io.BytesIO(csv_content.encode('utf-8')), 'catalogue.csv'), self.company.id
+            )
+
+        # A product deactivated by an admin is updated but stays inactive
+        self.assertEqual(import_rows("reference;unit_price\nCIM-045;70\n")['updated'], 1)
+        db.session.refresh(cement)
+        self.assertEqual((cement.is_active, float(cement.unit_price), cement.unit), (False, 70.0, 'sac'))
+
+        # A product created by a concurrent import after the SELECT is updated, not duplicated
+        missed = lambda *columns: select(*columns).where(false())
+        with patch('services.product_service.select', side_effect=missed):
+            self.assertEqual(import_rows("reference;unit_price;fr\nCIM-045;75;Ciment\n")['created'], 1)
+        self.assertEqual(Product.query.filter_by(reference="CIM-045").count(), 1)
+        db.session.refresh(cement)
+        self.assertEqual((cement.labels['fr'], float(cement.unit_price)), ('Ciment', 75.0))
+
+        # The form refuses a reference already in use, empty references are NULL
+        self.client.post('/products/add', data={'reference': 'CIM-045', 'label_fr': 'Autre ciment'})
+        for _ in range(2):
+            self.client.post('/products/add', data={'reference': ' ', 'label_fr': 'Sans référence'})
+        self.assertEqual(Product.query.filter_by(reference="CIM-045").count(), 1)
+        self.assertEqual(Product.query.filter(Product.reference.is_(None)).count(), 2)
+
+    def test_existing_duplicates_are_renamed_before_the_unique_index(self):
+        index = next(i for i in Product.__table__.indexes if i.name == 'uq_products_company_reference')
+        db.session.commit()
+        index.drop(db.engine)
+        db.session.add_all([
+            Product(company_id=self.company.id, reference="CIM-045", labels={'fr': 'Doublon'}),
+            Product(company_id=self.company.id, reference="", labels={'fr': 'Vide'}),
+            Product(company_id=self.company.id, reference="", labels={'fr': 'Vide'}),
+        ])
+        db.session.commit()
+        duplicate_id = Product.query.filter_by(reference="CIM-045").order_by(Product.id.desc()).first().id
+
+        self.assertEqual(ProductService.deduplicate_references(), 1)
+        index.create(db.engine)
+        self.assertEqual(
+            sorted(reference for reference, in db.session.execute(select(Product.reference)) if reference),
+            ['CIM-045', f'CIM-045~{duplicate_id}']
+        )
+        self.assertEqual(Product.query.filter_by(reference="CIM-045").one().unit, 'sac')
+
+    def test_export_streams_the_import_format(self):
+        response = self.client.get('/products/export')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/csv')
+
+        rows = list(iter_rows(io.BytesIO(response.data), 'export.csv'))
+        self.assertEqual(rows, [(2, {
+            'reference': 'CIM-045', 'category': 'materiau', 'unit': 'sac', 'unit_price': '60.00',
+            'fr': 'Ciment CPJ 45', 'en': '', 'ar': 'إسمنت', 'dr': ''
+        })])
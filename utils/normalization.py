@@ -0,0 +1,104 @@
+# /* * Nom de l'application : BTP Commande
+#  * Description : Normalisation des termes (français, arabe, darija)
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+
+import re
+import unicodedata
+from functools import lru_cache
+
+# Arabic letters folded to a single canonical form
+_ARABIC_FOLDING = str.maketrans({
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي',
+    'ؤ': 'و',
+    'ئ': 'ي',
+    'ی': 'ي',
+    'ک': 'ك',
+    'ڤ': 'ف',
+    'ڭ': 'ك',
+    'گ': 'ك',
+    'ـ': None,  # tatweel
+    # Arabic-Indic and Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+    **{chr(0x06f0 + i): str(i) for i in range(10)},
+})
+
+# Typographic variants users paste from Word or WhatsApp
+_PUNCTUATION_FOLDING = str.maketrans({
+    '’': "'", '‘': "'", 'ʼ': "'", '´': "'", '`': "'",
+    '‐': '-', '‑': '-', '–': '-', '—': '-',
+    'œ': 'oe', 'æ': 'ae', 'ß': 'ss',
+})
+
+# Translation keys holding Latin-script Darija
+DARIJA_LANGUAGES = ('dr', 'darija_lat', 'darija')
+
+# Latin-script Darija writes some Arabic sounds with digits (m3allem, l7ajar, 9ar3a)
+_DARIJA_DIGITS = {'2': 'a', '3': 'a', '5': 'kh', '7': 'h', '8': 'gh', '9': 'q'}
+
+# Quantities and units keep their digits untouched (5kg, 10m3, m2)
+_QUANTITY_RE = re.compile(r'^\d+([.,]\d+)?(kg|g|t|m|m2|m3|cm|mm|km|l|ml|u|x|pcs)?$')
+_UNIT_TOKENS = {
+    'kg', 'g', 't', 'm', 'm2', 'm3', 'cm', 'cm2', 'cm3', 'mm', 'mm2', 'mm3',
+    'km', 'km2', 'l', 'ml', 'u', 'x', 'pcs',
+}
+
+
+def is_quantity(token):
+    """True for a normalized token that is a number, a unit or both (50, kg, 50kg, m3)."""
+    return token in _UNIT_TOKENS or bool(_QUANTITY_RE.match(token))
+
+
+def _fold_darija_token(token):
+    if is_quantity(token) or not any('a' <= c <= 'z' for c in token):
+        return token
+    folded = []
+    for i, char in enumerate(token):
+        previous = token[i - 1] if i > 0 else ''
+        following = token[i + 1] if i + 1 < len(token) else ''
+        # Next to a letter, a digit stands for a letter, wherever it sits in the word
+        if char in _DARIJA_DIGITS and (previous.isalpha() or previous == "'" or following.isalpha()):
+            folded.append(_DARIJA_DIGITS[char])
+        else:
+            folded.append(char)
+    return ''.join(folded)
+
+
+def fold_darija_digits(key):
+    """
+    Spelling of a normalized Latin-Darija key without digit letters
+    (m3allem -> maallem, l7ajar -> lhajar, 9ar3a -> qaraa). Only meant for
+    Darija text (DARIJA_LANGUAGES): generic text keeps its digits.
+    """
+    return ' '.join(_fold_darija_token(token) for token in key.split())
+
+
+@lru_cache(maxsize=8192)
+def normalize_term(term):
+    """
+    Canonical form used as key by every dictionary lookup: NFKC, case
+    folding, Arabic letter folding, removal of diacritics, tatweel and
+    French accents. Digits are kept: Darija digit letters are folded by
+    fold_darija_digits, on Darija text only.
+    """
+    if not term:
+        return ''
+
+    text = unicodedata.normalize('NFKC', str(term)).casefold()
+    text = text.translate(_ARABIC_FOLDING).translate(_PUNCTUATION_FOLDING)
+
+    # Arabic harakat and French accents are both combining marks once decomposed
+    text = ''.join(
+        char for char in unicodedata.normalize('NFD', text)
+        if unicodedata.category(char) != 'Mn'
+    )
+    text = unicodedata.normalize('NFC', text)
+
+    return ' '.join(text.split())
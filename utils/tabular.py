@@ -0,0 +1,74 @@
+# /* * Nom de l'application : BTP Commande
+#  * Description : Lecture en flux des fichiers CSV et Excel importés
+#  * Produit de : MOA Digital Agency, www.myoneart.com
+#  * Fait par : Aisance KALONJI, www.aisancekalonji.com
+#  * Auditer par : La CyberConfiance, www.cyberconfiance.com
+#  */
+
+import csv
+import io
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx')
+
+# Bytes read to guess the CSV delimiter
+_SNIFF_SIZE = 8192
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    # Excel stores whole numbers as floats (12 -> 12.0)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _iter_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        sample = text.read(_SNIFF_SIZE)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(text, dialect)
+    finally:
+        # The upload stream belongs to the request, do not close it with the wrapper
+        text.detach()
+
+
+def _iter_xlsx(stream):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_rows(stream, filename):
+    """
+    Yields (line_number, row) for every data row of a CSV or .xlsx upload
+    without loading the file in memory. row maps the lowercased header of
+    each column to the stripped cell value ('' when empty); line numbers
+    are the ones shown by a spreadsheet, the header being line 1.
+    """
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        raw_rows = _iter_csv(stream)
+    elif name.endswith('.xlsx'):
+        raw_rows = _iter_xlsx(stream)
+    else:
+        raise ValueError("Format de fichier non supporté")
+
+    header = None
+    for line_number, values in enumerate(raw_rows, start=1):
+        if header is None:
+            header = [_cell(value).lower() for value in values]
+            continue
+        yield line_number, {
+            column: _cell(value)
+            for column, value in zip(header, values) if column
+        }